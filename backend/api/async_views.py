@@ -0,0 +1,95 @@
+"""Async GET handlers of the hottest read endpoints, for ASGI.
+
+With ``ASYNC_VIEWS`` on, GET requests to the recipe list and detail and
+to the ingredient search are dispatched here to the ``alist`` and
+``aretrieve`` actions of the viewsets. Their queries run on the async
+ORM, so a worker serves other requests while one waits for the database;
+serialization, which DRF only does synchronously, runs in the request's
+worker thread. Other methods go to the regular views.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` looking the token up on the async ORM."""
+
+    def authenticate_credentials(self, key):
+        # authenticate() validates the header, the lookup is async.
+        return key
+
+    async def aauthenticate(self, request):
+        key = self.authenticate(request)
+        if key is None:
+            return None
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related("user").aget(key=key)
+        except model.DoesNotExist:
+            raise AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_("User inactive or deleted."))
+        return (token.user, token)
+
+
+authentication = AsyncTokenAuthentication()
+
+
+async def authenticate(request):
+    """Set the user and token of a DRF request, as ``request.user`` would.
+
+    Token is the only authentication class of the API.
+    """
+    try:
+        credentials = await authentication.aauthenticate(request)
+    except AuthenticationFailed:
+        request.user, request.auth = api_settings.UNAUTHENTICATED_USER(), None
+        raise
+    if credentials is None:
+        credentials = (api_settings.UNAUTHENTICATED_USER(), None)
+    request.user, request.auth = credentials
+
+
+async def dispatch(sync_view, request, kwargs):
+    """``APIView.dispatch`` running the async action of the viewset."""
+    view = sync_view.cls(**sync_view.initkwargs)
+    view.action_map = dict(sync_view.actions)
+    view.action_map.setdefault("head", view.action_map["get"])
+    for method, action in view.action_map.items():
+        setattr(view, method, getattr(view, action))
+    view.args, view.kwargs = (), kwargs
+    request = view.initialize_request(request, **kwargs)
+    view.request = request
+    view.headers = view.default_response_headers
+    try:
+        await authenticate(request)
+        # Not ProfilingMixin.initial(): a sampler of the event loop thread
+        # would record whatever other requests run on it.
+        APIView.initial(view, request, **kwargs)
+        response = await getattr(view, f"a{view.action}")(request, **kwargs)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    return view.finalize_response(request, response, **kwargs)
+
+
+def async_read(sync_view):
+    """Serve GET of a viewset URL asynchronously, other methods as before.
+
+    ``sync_view`` is the router's view of the URL; its attributes are
+    copied, so the request is reported under the same viewset action.
+    """
+    regular = sync_to_async(sync_view)
+
+    @functools.wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        if request.method != "GET":
+            return await regular(request, *args, **kwargs)
+        return await dispatch(sync_view, request, kwargs)
+
+    return view
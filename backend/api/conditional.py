@@ -0,0 +1,89 @@
+"""Validators and cache policies for conditional GET requests."""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date
+
+from .instrumentation import serializing
+
+
+def make_etag(request, *parts, per_user=True):
+    """Return a weak ETag for the requested URL and ``parts``.
+
+    The URL covers the host, the page and the representation options;
+    ``parts`` must change whenever the response content does.
+    """
+    user = request.user.pk if per_user else None
+    digest = hashlib.sha256(
+        repr((request.build_absolute_uri(), user, parts)).encode()
+    )
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def conditional_response(
+    request, build, etag, last_modified=None, per_user=True, max_age=None
+):
+    """Return 304 when the client's copy is current, else ``build()``.
+
+    ``build`` only runs for a full response, so serialization is skipped
+    for revalidated requests. Per-user responses are private and always
+    revalidated; shared ones may be cached for ``max_age`` seconds
+    (``API_PUBLIC_MAX_AGE`` by default).
+    """
+    timestamp = _timestamp(last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        with serializing():
+            response = build()
+    return _with_validators(
+        request, response, etag, timestamp, per_user, max_age
+    )
+
+
+async def aconditional_response(
+    request, build, etag, last_modified=None, per_user=True, max_age=None
+):
+    """``conditional_response`` for async views.
+
+    ``build`` serializes and may query the database, so it runs in the
+    request's worker thread.
+    """
+    timestamp = _timestamp(last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        with serializing():
+            response = await sync_to_async(build)()
+    return _with_validators(
+        request, response, etag, timestamp, per_user, max_age
+    )
+
+
+def _timestamp(last_modified):
+    if last_modified is None:
+        return None
+    return int(last_modified.timestamp())
+
+
+def _with_validators(request, response, etag, timestamp, per_user, max_age):
+    response["ETag"] = etag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    if per_user and request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        if max_age is None:
+            max_age = settings.API_PUBLIC_MAX_AGE
+        patch_cache_control(response, public=True, max_age=max_age)
+    if per_user:
+        patch_vary_headers(response, ["Authorization"])
+    return response
@@ -0,0 +1,138 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    F,
+    IntegerField,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import SEARCH_CONFIG, RecipeIngredient
+
+
+class RecipeSearchFilter(filters.SearchFilter):
+    """``?search=`` over recipe names, or ranked full-text search.
+
+    With ``?search_mode=fulltext`` the query is matched against the stored
+    full-text vector of name, description and ingredient names and the
+    results are ordered by rank.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if request.query_params.get("search_mode") != "fulltext":
+            return super().filter_queryset(request, queryset, view)
+        text = request.query_params.get(self.search_param, "").strip()
+        if not text:
+            return queryset
+        if connection.vendor != "postgresql":
+            return self.filter_without_vector(queryset, text)
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type="websearch"
+        )
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "-pub_date")
+        )
+
+    def filter_without_vector(self, queryset, text):
+        """Substring search with the same field weights, for SQLite."""
+        name = Q(name__icontains=text)
+        description = Q(text__icontains=text)
+        ingredient = Q(ingredients__name__icontains=text)
+        matching = queryset.model.objects.filter(
+            name | description | ingredient
+        ).values("pk")
+        return (
+            queryset.filter(pk__in=matching)
+            .annotate(
+                rank=Case(
+                    When(name, then=Value(3)),
+                    When(description, then=Value(2)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("-rank", "-pub_date")
+        )
+
+
+class RecipeIngredientSetFilter(filters.BaseFilterBackend):
+    """Filter recipes by sets of comma-separated ingredient ids.
+
+    ``?ingredients_all=`` keeps recipes containing every ingredient,
+    ``?ingredients_any=`` recipes containing at least one of them and
+    ``?pantry=`` recipes that can be cooked from the given ingredients only.
+    On PostgreSQL these are array operators on the GIN-indexed
+    ``recipes_recipe.ingredient_ids`` column. A parameter without ids is
+    ignored, as the array and join versions disagree on an empty set.
+    """
+
+    lookups = {
+        "ingredients_all": "contains",
+        "ingredients_any": "overlap",
+        "pantry": "contained_by",
+    }
+    array_operators = {
+        "contains": "@>",
+        "overlap": "&&",
+        "contained_by": "<@",
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in self.lookups.items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            ids = self.parse_ids(param, value)
+            if not ids:
+                continue
+            if connection.vendor == "postgresql":
+                queryset = queryset.filter(
+                    RawSQL(
+                        f"{queryset.model._meta.db_table}.ingredient_ids "
+                        f"{self.array_operators[lookup]} %s::bigint[]",
+                        (ids,),
+                        output_field=BooleanField(),
+                    )
+                )
+            else:
+                queryset = self.filter_without_array(queryset, lookup, ids)
+        return queryset
+
+    def parse_ids(self, param, value):
+        try:
+            return sorted({int(item) for item in value.split(",") if item})
+        except ValueError:
+            raise ValidationError(
+                {param: ["Ожидается список id ингредиентов через запятую."]}
+            )
+
+    def filter_without_array(self, queryset, lookup, ids):
+        """The same filters as joins over RecipeIngredient, for SQLite."""
+        if lookup == "contains":
+            return queryset.filter(
+                pk__in=RecipeIngredient.objects.filter(ingredient__in=ids)
+                .values("recipe")
+                .annotate(found=Count("ingredient", distinct=True))
+                .filter(found=len(ids))
+                .values("recipe")
+            )
+        if lookup == "overlap":
+            return queryset.filter(
+                pk__in=RecipeIngredient.objects.filter(
+                    ingredient__in=ids
+                ).values("recipe")
+            )
+        return queryset.exclude(
+            pk__in=RecipeIngredient.objects.exclude(
+                ingredient__in=ids
+            ).values("recipe")
+        )
@@ -0,0 +1,139 @@
+import hashlib
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+# Sorts after every character: closes the range of keys sharing a prefix
+MAX_CHAR = chr(0x10FFFF)
+WORD_RE = re.compile(r"\w+")
+
+Snapshot = namedtuple("Snapshot", ["built_at", "keys", "rows", "digest"])
+
+
+def trigrams(text):
+    """Split ``text`` into trigrams the way PostgreSQL pg_trgm does."""
+    result = set()
+    for word in WORD_RE.findall(text.casefold()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IngredientIndex:
+    """Per-process, read-only prefix index over all ingredients.
+
+    Ingredients are kept as serialized rows sorted by casefolded name, so a
+    ``?name=`` prefix query is two binary searches and a slice. The index
+    is dropped when an ingredient is saved or deleted in this process and
+    rebuilt at most every ``INGREDIENT_INDEX_TTL`` seconds to pick up
+    changes made elsewhere (other workers, bulk imports).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._postings = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _build(self):
+        rows = list(
+            Ingredient.objects.values("id", "name", "measurement_unit")
+        )
+        rows.sort(key=lambda row: (row["name"].casefold(), row["id"]))
+        keys = [row["name"].casefold() for row in rows]
+        digest = hashlib.sha256(repr(rows).encode()).hexdigest()
+        return Snapshot(time.monotonic(), keys, rows, digest)
+
+    def get_snapshot(self):
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or time.monotonic() - snapshot.built_at
+            > settings.INGREDIENT_INDEX_TTL
+        ):
+            with self._lock:
+                if snapshot is self._snapshot:
+                    self._snapshot = self._build()
+                snapshot = self._snapshot
+        return snapshot
+
+    async def aget_snapshot(self):
+        """``get_snapshot`` for async views: rebuilds run in a thread."""
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or time.monotonic() - snapshot.built_at
+            > settings.INGREDIENT_INDEX_TTL
+        ):
+            snapshot = await sync_to_async(self.get_snapshot)()
+        return snapshot
+
+    def _get_postings(self, snapshot):
+        """Return the trigram -> positions map, built on first fuzzy use."""
+        cached = self._postings
+        if cached is None or cached[0] is not snapshot:
+            with self._lock:
+                cached = self._postings
+                if cached is None or cached[0] is not snapshot:
+                    postings = {}
+                    for position, key in enumerate(snapshot.keys):
+                        for trigram in trigrams(key):
+                            postings.setdefault(trigram, []).append(position)
+                    cached = self._postings = (snapshot, postings)
+        return cached[1]
+
+    def version(self):
+        """Return a digest of the indexed ingredients."""
+        return self.get_snapshot().digest
+
+    def search(self, prefix="", snapshot=None):
+        """Return serialized ingredients whose name starts with ``prefix``."""
+        snapshot = snapshot or self.get_snapshot()
+        if not prefix:
+            return snapshot.rows
+        key = prefix.casefold()
+        start = bisect_left(snapshot.keys, key)
+        end = bisect_left(snapshot.keys, key + MAX_CHAR, start)
+        return snapshot.rows[start:end]
+
+    def fuzzy_search(self, query, limit, snapshot=None):
+        """Rank ingredients by trigram word similarity to ``query``.
+
+        Mirrors the PostgreSQL search for databases without pg_trgm:
+        prefix matches come first, then names containing a word similar
+        to the query, scored by the share of query trigrams they contain.
+        """
+        snapshot = snapshot or self.get_snapshot()
+        key = query.casefold().strip()
+        query_trigrams = trigrams(key)
+        if not query_trigrams:
+            return []
+        postings = self._get_postings(snapshot)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(postings.get(trigram, ()))
+        threshold = settings.INGREDIENT_FUZZY_THRESHOLD
+        candidates = []
+        for position, count in shared.items():
+            score = count / len(query_trigrams)
+            name = snapshot.keys[position]
+            is_prefix = name.startswith(key)
+            if is_prefix or score >= threshold:
+                candidates.append((not is_prefix, -score, name, position))
+        return [
+            snapshot.rows[position]
+            for *_, position in heapq.nsmallest(limit, candidates)
+        ]
+
+
+ingredient_index = IngredientIndex()
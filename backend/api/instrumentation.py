@@ -0,0 +1,243 @@
+"""Per-request timings, SQL counts and N+1 detection.
+
+``InstrumentationMiddleware`` measures the total time of every request,
+the time and number of its SQL statements and the time spent in
+``serializing()`` blocks: building conditional responses and rendering
+JSON bodies. The figures are written as one JSON log line and, to staff
+users or under ``DEBUG``, sent back in a ``Server-Timing`` header.
+Statements of the same shape
+repeated more than ``INSTRUMENTATION_N_PLUS_ONE_THRESHOLD`` times are
+reported with the view that ran them. The same figures feed the
+Prometheus metrics of ``api.metrics``.
+
+Statements are counted by an execute wrapper added to every database
+connection when it opens. It reports to the metrics of the current
+context, so the queries of async views, which run in worker threads, are
+counted as well.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.functional import SimpleLazyObject, empty
+
+from . import metrics as prometheus
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("request_metrics", default=None)
+_installed = False
+
+# Placeholder lists such as IN (%s, %s) or VALUES rows vary in length
+PLACEHOLDER_RUN = re.compile(r"%s(?:\s*,\s*%s)+")
+ROW_RUN = re.compile(r"\(%s\.\.\.\)(?:\s*,\s*\(%s\.\.\.\))+")
+WHITESPACE = re.compile(r"\s+")
+
+
+def sql_shape(sql):
+    """Return ``sql`` with placeholder lists collapsed to one item."""
+    shape = PLACEHOLDER_RUN.sub("%s...", sql)
+    shape = ROW_RUN.sub("(%s...)...", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+
+def view_name(view_func, method):
+    """Name a view as ``RecipeViewSet.list`` or ``module.function``."""
+    view_class = getattr(view_func, "cls", None)
+    if view_class is None:
+        return f"{view_func.__module__}.{view_func.__qualname__}"
+    actions = getattr(view_func, "actions", None) or {}
+    return f"{view_class.__name__}.{actions.get(method, method)}"
+
+
+class RequestMetrics:
+    """Figures of one request, also used as a database execute wrapper."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.serialize_time = 0.0
+        self._serializing = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.shapes[sql_shape(sql)] += 1
+
+    @contextmanager
+    def serializing(self):
+        # Serializers nested in SerializerMethodFields are not counted twice.
+        self._serializing += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._serializing -= 1
+            if not self._serializing:
+                self.serialize_time += time.perf_counter() - started
+
+    @property
+    def query_count(self):
+        return sum(self.shapes.values())
+
+    def repeated(self, threshold):
+        """Statement shapes run more than ``threshold`` times."""
+        return [
+            {"count": count, "sql": shape}
+            for shape, count in self.shapes.most_common()
+            if count > threshold
+        ]
+
+
+@contextmanager
+def serializing():
+    """Count the block as serialization time of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.serializing():
+        yield
+
+
+def _execute(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _add_execute_wrapper(sender, connection, **kwargs):
+    # First in the list: execute_wrapper() blocks pop the last wrapper.
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _execute)
+
+
+def install():
+    """Count the statements of every database connection."""
+    global _installed
+    if _installed:
+        return
+    connection_created.connect(_add_execute_wrapper)
+    for connection in connections.all(initialized_only=True):
+        _add_execute_wrapper(None, connection)
+    _installed = True
+
+
+def shows_timings(request):
+    """Whether ``Server-Timing`` may be sent in reply to ``request``.
+
+    Timings reveal how a request was served, so they go to staff users
+    only, unless ``DEBUG`` or ``INSTRUMENTATION_PUBLIC_TIMINGS`` is on.
+    """
+    if settings.DEBUG or settings.INSTRUMENTATION_PUBLIC_TIMINGS:
+        return True
+    user = getattr(request, "user", None)
+    # A user nobody has loaded is not loaded here: that would be a query,
+    # and under ASGI a synchronous one on the event loop.
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return False
+    return bool(user and user.is_staff)
+
+
+class InstrumentationMiddleware:
+    """Measure each request and report it in headers and logs.
+
+    Streaming bodies are produced after the middleware returns, so only
+    the work done before the first byte is measured for them. Under ASGI
+    the middleware runs on the event loop, without a thread switch.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        prometheus.REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            prometheus.REQUESTS_IN_PROGRESS.dec()
+            _current.reset(token)
+        self.report(request, response, metrics, connections.all())
+        return response
+
+    async def __acall__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        prometheus.REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            prometheus.REQUESTS_IN_PROGRESS.dec()
+            _current.reset(token)
+        # The connections of an async request belong to its worker thread.
+        self.report(request, response, metrics, None)
+        return response
+
+    def report(self, request, response, metrics, databases):
+        total = time.perf_counter() - metrics.started
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            metrics.view = view_name(match.func, request.method.lower())
+        if shows_timings(request):
+            response["Server-Timing"] = ", ".join(
+                (
+                    f"total;dur={total * 1000:.1f}",
+                    f"db;dur={metrics.db_time * 1000:.1f};"
+                    f'desc="{metrics.query_count} queries"',
+                    f"serialize;dur={metrics.serialize_time * 1000:.1f}",
+                )
+            )
+        prometheus.observe_request(
+            metrics.view,
+            response.status_code,
+            total,
+            metrics.query_count,
+            databases,
+        )
+        repeated = metrics.repeated(
+            settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        )
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": metrics.view,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 2),
+            "db_ms": round(metrics.db_time * 1000, 2),
+            "queries": metrics.query_count,
+            "serialize_ms": round(metrics.serialize_time * 1000, 2),
+            "size": None if response.streaming else len(response.content),
+        }
+        if repeated:
+            record["repeated_queries"] = repeated
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
@@ -0,0 +1,1059 @@
+import argparse
+import base64
+import json
+import math
+import logging
+import platform
+import re
+import statistics
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api import recipe_cache
+from api.ingredient_index import ingredient_index
+from recipes.models import (
+    Favorite,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from users.models import Follow
+
+User = get_user_model()
+
+PASSWORD = "benchmark-password"
+PAGE_SIZE = 6
+BULK_SIZE = 20
+PERCENTILES = (50, 90, 99)
+CART_SIZES = "1,10,100"
+FUZZY_BUDGET_MS = 50
+FUZZY_SCALE = 100
+# Reported by api.instrumentation.InstrumentationMiddleware
+SERIALIZE_TIMING = re.compile(r"serialize;dur=([\d.]+)")
+
+
+def percentile(values, rank):
+    """Linear interpolation between the closest ranks."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * rank / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower
+    )
+
+
+def image_bytes(image_format="PNG", size=(256, 256)):
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def data_uri(content, ext="png"):
+    return f"data:image/{ext};base64,{base64.b64encode(content).decode()}"
+
+
+def sizes(value):
+    """Parse ``--cart-sizes``: comma-separated positive integers."""
+    try:
+        result = sorted({int(part) for part in value.split(",") if part})
+    except ValueError:
+        result = []
+    if not result or result[0] < 1:
+        raise argparse.ArgumentTypeError(
+            f"неверный список размеров корзины: {value}"
+        )
+    return result
+
+
+def cursor_at(recipe):
+    """The keyset cursor continuing after ``recipe`` in the default order.
+
+    Mirrors ``KeysetPagination.encode_cursor`` so a deep cursor page can
+    be measured without walking every page before it.
+    """
+    payload = json.dumps(
+        {"p": [recipe.pub_date.isoformat(), recipe.pk], "r": False}
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+class QueryCounter:
+    """Counts the statements run on a connection, for ``execute_wrapper``.
+
+    Unlike ``connection.queries`` it needs no debug cursor and does not
+    lose count when the capped query log wraps around.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Scenario:
+    """One request measured ``iterations`` times.
+
+    ``paths`` are cycled through, so one scenario can spread over several
+    queries. ``before(client)`` runs untimed ahead of each request and may
+    return extra request headers; ``after(client, response)`` runs untimed
+    after it, usually to undo a write. ``context()`` wraps the whole run,
+    ``budget_ms`` is the p99 the scenario is expected to stay under and
+    ``extra`` is copied into its result.
+    """
+
+    def __init__(
+        self,
+        name,
+        method,
+        paths,
+        client="anon",
+        data=None,
+        content_type="application/json",
+        headers=None,
+        before=None,
+        after=None,
+        prepare=None,
+        writes=False,
+        context=None,
+        budget_ms=None,
+        extra=None,
+    ):
+        self.name = name
+        self.method = method
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.client = client
+        self.data = data
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.before = before
+        self.after = after
+        self.prepare = prepare
+        self.writes = writes
+        self.context = context or nullcontext
+        self.budget_ms = budget_ms
+        self.extra = extra or {}
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержки и число SQL-запросов эндпоинтов API на текущей "
+        "базе и сохраняет результаты в JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            default=30,
+            help="Сколько раз выполнять каждый запрос",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=3,
+            help="Сколько запросов выполнить до замеров",
+        )
+        parser.add_argument(
+            "--output",
+            help="Файл результатов (по умолчанию benchmark-<время>.json)",
+        )
+        parser.add_argument(
+            "--only",
+            action="append",
+            default=[],
+            help="Запустить сценарии, в названии которых есть подстрока",
+        )
+        parser.add_argument(
+            "--read-only",
+            action="store_true",
+            help="Пропустить сценарии, изменяющие данные",
+        )
+        parser.add_argument(
+            "--clear-cache",
+            action="store_true",
+            help="Очистить кэш перед запуском",
+        )
+        parser.add_argument(
+            "--compare",
+            help="JSON прошлого запуска для сравнения",
+        )
+        parser.add_argument(
+            "--cart-sizes",
+            type=sizes,
+            default=sizes(CART_SIZES),
+            help=(
+                "Размеры корзин через запятую для замера выгрузки списка "
+                f"покупок (по умолчанию {CART_SIZES})"
+            ),
+        )
+        parser.add_argument(
+            "--fuzzy-budget",
+            type=float,
+            default=FUZZY_BUDGET_MS,
+            help=(
+                "Допустимая p99 нечёткого поиска ингредиентов, мс "
+                f"(по умолчанию {FUZZY_BUDGET_MS})"
+            ),
+        )
+        parser.add_argument(
+            "--fuzzy-scale",
+            type=int,
+            default=FUZZY_SCALE,
+            help=(
+                "Во сколько раз увеличить каталог ингредиентов для замера "
+                f"нечёткого поиска, 0 — не увеличивать (по умолчанию "
+                f"{FUZZY_SCALE})"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError(
+                "В базе нет рецептов, сначала выполните generate_fake_data"
+            )
+        if options["clear_cache"]:
+            cache.clear()
+        self.guest = None
+        self.options = options
+        # One log line per request would drown the report; N+1 warnings stay.
+        logging.getLogger("api.instrumentation").setLevel(logging.WARNING)
+        try:
+            self.fixtures()
+            scenarios = [
+                scenario
+                for scenario in self.scenarios()
+                if not (options["read_only"] and scenario.writes)
+                and (
+                    not options["only"]
+                    or any(part in scenario.name for part in options["only"])
+                )
+            ]
+            if not scenarios:
+                raise CommandError("Ни один сценарий не выбран")
+            cache_before = recipe_cache.stats()
+            started = time.monotonic()
+            # Server-Timing is sent to staff only; the clients here are not.
+            with override_settings(INSTRUMENTATION_PUBLIC_TIMINGS=True):
+                results = [
+                    self.run(
+                        scenario, options["iterations"], options["warmup"]
+                    )
+                    for scenario in scenarios
+                ]
+            elapsed = time.monotonic() - started
+        finally:
+            self.cleanup()
+        cache_after = recipe_cache.stats()
+        report = {
+            "meta": self.metadata(options, elapsed),
+            "recipe_cache": {
+                key: cache_after[key] - cache_before[key]
+                for key in cache_after
+            },
+            "results": results,
+        }
+        output = options["output"] or "benchmark-{}.json".format(
+            datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        )
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        if options["compare"]:
+            self.compare(results, options["compare"])
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {output}"))
+
+    def fixtures(self):
+        """Pick the users and rows the scenarios are run against."""
+        self.host = next(
+            (
+                host
+                for host in settings.ALLOWED_HOSTS
+                if host != "*" and not host.startswith(".")
+            ),
+            "testserver",
+        )
+        # The most active follower: the heaviest feed and subscriptions.
+        self.reader = (
+            User.objects.annotate(follows=Count("follower"))
+            .filter(follows__gt=0)
+            .order_by("-follows")
+            .first()
+        ) or User.objects.order_by("pk").first()
+        self.author = User.objects.filter(recipes_count__gt=0).order_by(
+            "-recipes_count"
+        ).first() or Recipe.objects.order_by("pk").first().author
+        self.recipe = Recipe.objects.order_by("-favorites_count").first()
+        self.own_recipe = Recipe.objects.filter(author=self.author).first()
+        favorites = Favorite.objects.filter(user=self.reader).values("recipe")
+        carts = ShoppingCart.objects.filter(user=self.reader).values("recipe")
+        self.free_recipes = list(
+            Recipe.objects.exclude(pk__in=favorites)
+            .exclude(pk__in=carts)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:BULK_SIZE]
+        )
+        followed = Follow.objects.filter(user=self.reader).values("following")
+        self.free_authors = list(
+            User.objects.exclude(pk__in=followed)
+            .exclude(pk=self.reader.pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:BULK_SIZE]
+        )
+        staples = list(
+            RecipeIngredient.objects.values("ingredient")
+            .annotate(uses=Count("pk"))
+            .order_by("-uses")
+            .values_list("ingredient", flat=True)[:30]
+        )
+        self.staples = staples
+        self.ingredients = list(
+            Ingredient.objects.order_by("?").values_list("pk", "name")[:50]
+        )
+        self.search_words = sorted(
+            {
+                name.split()[0]
+                for name in Recipe.objects.order_by("?").values_list(
+                    "name", flat=True
+                )[:20]
+            }
+        )
+        recipes_total = Recipe.objects.count()
+        self.deep_page = max(1, math.ceil(recipes_total / PAGE_SIZE) * 9 // 10)
+        self.deep_recipe = Recipe.objects.order_by("-pub_date", "-id")[
+            max(0, recipes_total * 9 // 10 - 1)
+        ]
+        # A throwaway account for password, avatar and login scenarios.
+        self.guest = User.objects.create_user(
+            username=f"bench_{uuid.uuid4().hex[:8]}",
+            email=f"bench_{uuid.uuid4().hex[:8]}@example.com",
+            password=PASSWORD,
+            first_name="Benchmark",
+            last_name="Guest",
+        )
+        self.registered = []
+        self.clients = {
+            "anon": Client(HTTP_HOST=self.host),
+            "reader": self.client_for(self.reader),
+            "author": self.client_for(self.author),
+            "guest": self.client_for(self.guest),
+        }
+        for size in self.options["cart_sizes"]:
+            user = self.cart_owner(size)
+            self.registered.append(user.pk)
+            self.clients[f"cart {size}"] = self.client_for(user)
+
+    def client_for(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(
+            HTTP_HOST=self.host, HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+
+    def cart_owner(self, size):
+        """A throwaway account with ``size`` recipes in its cart."""
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(
+            username=f"bench_cart_{suffix}",
+            email=f"bench_cart_{suffix}@example.com",
+            password=PASSWORD,
+            first_name="Benchmark",
+            last_name="Cart",
+        )
+        # bulk_create sends no signals, and in_carts_count is left alone
+        # because the account is deleted afterwards.
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe_id=pk)
+            for pk in Recipe.objects.order_by("pk").values_list(
+                "pk", flat=True
+            )[:size]
+        )
+        ShoppingListItem.objects.refresh([user.pk])
+        return user
+
+    @contextmanager
+    def enlarged_catalogue(self, scale):
+        """Multiply the ingredients ``scale`` times, rolled back on exit.
+
+        The copies get a numeric suffix, so prefix and typo queries match
+        ``scale`` times as many names as on the real catalogue.
+        """
+        max_length = Ingredient._meta.get_field("name").max_length
+        with transaction.atomic():
+            rows = list(
+                Ingredient.objects.values_list("name", "measurement_unit")
+            )
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(
+                        name=f"{name[:max_length - 6]} {copy}",
+                        measurement_unit=unit,
+                    )
+                    for copy in range(1, scale)
+                    for name, unit in rows
+                ),
+                batch_size=5000,
+                ignore_conflicts=True,
+            )
+            ingredient_index.invalidate()
+            try:
+                yield
+            finally:
+                transaction.set_rollback(True)
+                ingredient_index.invalidate()
+
+    def cleanup(self):
+        User.objects.filter(pk__in=getattr(self, "registered", [])).delete()
+        if self.guest is not None:
+            self.guest.delete()
+
+    def scenarios(self):
+        recipe = f"/api/recipes/{self.recipe.pk}/"
+        staples = self.staples
+        free = self.free_recipes[0] if self.free_recipes else self.recipe.pk
+        author = self.free_authors[0] if self.free_authors else self.author.pk
+        prefixes = [name[:2] for _, name in self.ingredients]
+        typos = [name[:1] + name[2:7] for _, name in self.ingredients]
+        fuzzy = [f"/api/ingredients/?name={typo}&fuzzy=1" for typo in typos]
+        scale = self.options["fuzzy_scale"]
+        ingredient_payload = [
+            {"id": pk, "amount": 10} for pk in (staples or [])[:5]
+        ] or [{"id": self.ingredients[0][0], "amount": 10}]
+        recipe_payload = {
+            "name": "Бенчмарк",
+            "text": "Рецепт для замеров.",
+            "cooking_time": 10,
+            "ingredients": ingredient_payload,
+            "image": data_uri(image_bytes()),
+        }
+        ids = {"ids": self.free_recipes}
+        author_ids = {"ids": self.free_authors}
+        return [
+            # Recipes
+            Scenario("recipes list anon", "get", "/api/recipes/"),
+            Scenario(
+                "recipes list auth", "get", "/api/recipes/", client="reader"
+            ),
+            Scenario(
+                "recipes list deep page",
+                "get",
+                f"/api/recipes/?page={self.deep_page}",
+            ),
+            Scenario(
+                "recipes list cursor first",
+                "get",
+                "/api/recipes/?pagination=cursor",
+            ),
+            Scenario(
+                "recipes list cursor deep",
+                "get",
+                f"/api/recipes/?cursor={cursor_at(self.deep_recipe)}",
+            ),
+            Scenario(
+                "recipes list limit 100", "get", "/api/recipes/?limit=100"
+            ),
+            Scenario(
+                "recipes list inline images",
+                "get",
+                "/api/recipes/?inline_images=1",
+            ),
+            Scenario(
+                "recipes list image meta", "get", "/api/recipes/?image_meta=1"
+            ),
+            Scenario(
+                "recipes list by author",
+                "get",
+                f"/api/recipes/?author={self.author.pk}",
+            ),
+            Scenario(
+                "recipes list popular",
+                "get",
+                "/api/recipes/?ordering=-favorites_count",
+            ),
+            Scenario(
+                "recipes list favorited",
+                "get",
+                "/api/recipes/?is_favorited=1",
+                client="reader",
+            ),
+            Scenario(
+                "recipes list in cart",
+                "get",
+                "/api/recipes/?is_in_shopping_cart=1",
+                client="reader",
+            ),
+            Scenario(
+                "recipes search name",
+                "get",
+                [f"/api/recipes/?search={word}" for word in self.search_words],
+            ),
+            Scenario(
+                "recipes search fulltext",
+                "get",
+                [
+                    f"/api/recipes/?search={word}&search_mode=fulltext"
+                    for word in self.search_words
+                ],
+            ),
+            Scenario(
+                "recipes ingredients all",
+                "get",
+                "/api/recipes/?ingredients_all="
+                + ",".join(map(str, staples[:2])),
+            ),
+            Scenario(
+                "recipes ingredients any",
+                "get",
+                "/api/recipes/?ingredients_any="
+                + ",".join(map(str, staples[:5])),
+            ),
+            Scenario(
+                "recipes pantry",
+                "get",
+                "/api/recipes/?pantry=" + ",".join(map(str, staples)),
+            ),
+            Scenario(
+                "recipes list 304",
+                "get",
+                "/api/recipes/",
+                client="reader",
+                prepare=self.revalidate("/api/recipes/", "reader"),
+            ),
+            Scenario("recipe detail anon", "get", recipe),
+            Scenario("recipe detail auth", "get", recipe, client="reader"),
+            Scenario(
+                "recipe detail inline images",
+                "get",
+                f"{recipe}?inline_images=1",
+            ),
+            Scenario(
+                "recipe detail 304",
+                "get",
+                recipe,
+                client="reader",
+                prepare=self.revalidate(recipe, "reader"),
+            ),
+            Scenario("recipe get-link", "get", f"{recipe}get-link/"),
+            Scenario("recipe short link", "get", f"/r/{self.recipe.pk}/"),
+            Scenario(
+                "recipes feed", "get", "/api/recipes/feed/", client="reader"
+            ),
+            Scenario(
+                "recipes feed 304",
+                "get",
+                "/api/recipes/feed/",
+                client="reader",
+                prepare=self.revalidate("/api/recipes/feed/", "reader"),
+            ),
+            *[
+                Scenario(
+                    f"shopping list {export_format}",
+                    "get",
+                    "/api/recipes/download_shopping_cart/"
+                    f"?format={export_format}",
+                    client="reader",
+                )
+                for export_format in ("txt", "csv", "pdf")
+            ],
+            *[
+                Scenario(
+                    f"shopping list cart {size}",
+                    "get",
+                    "/api/recipes/download_shopping_cart/",
+                    client=f"cart {size}",
+                    extra={"cart_size": size},
+                )
+                for size in self.options["cart_sizes"]
+            ],
+            Scenario(
+                "recipe create",
+                "post",
+                "/api/recipes/",
+                client="author",
+                data=recipe_payload,
+                after=self.delete_created("/api/recipes/{}/"),
+                writes=True,
+            ),
+            Scenario(
+                "recipe update",
+                "patch",
+                f"/api/recipes/{self.own_recipe.pk}/",
+                client="author",
+                data={
+                    "name": self.own_recipe.name,
+                    "ingredients": ingredient_payload,
+                },
+                writes=True,
+            ),
+            Scenario(
+                "recipe delete",
+                "delete",
+                "/api/recipes/{created}/",
+                client="author",
+                before=self.create_first(
+                    "/api/recipes/", recipe_payload
+                ),
+                writes=True,
+            ),
+            Scenario(
+                "recipe image upload",
+                "put",
+                f"/api/recipes/{self.own_recipe.pk}/image/",
+                client="author",
+                data=lambda: {
+                    "image": SimpleUploadedFile(
+                        "image.png", image_bytes(), "image/png"
+                    )
+                },
+                content_type=MULTIPART_CONTENT,
+                writes=True,
+            ),
+            *self.toggle(
+                "favorite", f"/api/recipes/{free}/favorite/", "reader"
+            ),
+            *self.toggle(
+                "shopping cart",
+                f"/api/recipes/{free}/shopping_cart/",
+                "reader",
+            ),
+            *self.toggle(
+                "bulk favorite", "/api/recipes/favorite/", "reader", ids
+            ),
+            *self.toggle(
+                "bulk shopping cart",
+                "/api/recipes/shopping_cart/",
+                "reader",
+                ids,
+            ),
+            # Ingredients
+            Scenario("ingredients all", "get", "/api/ingredients/"),
+            Scenario(
+                "ingredients prefix",
+                "get",
+                [f"/api/ingredients/?name={prefix}" for prefix in prefixes],
+            ),
+            Scenario(
+                "ingredients fuzzy",
+                "get",
+                fuzzy,
+                budget_ms=self.options["fuzzy_budget"],
+            ),
+            *(
+                [
+                    Scenario(
+                        f"ingredients fuzzy x{scale}",
+                        "get",
+                        fuzzy,
+                        context=lambda: self.enlarged_catalogue(scale),
+                        budget_ms=self.options["fuzzy_budget"],
+                        extra={"catalogue_scale": scale},
+                    )
+                ]
+                if scale > 1
+                else []
+            ),
+            Scenario(
+                "ingredients search",
+                "get",
+                [f"/api/ingredients/?search={prefix}" for prefix in prefixes],
+            ),
+            Scenario(
+                "ingredients 304",
+                "get",
+                "/api/ingredients/?name=" + prefixes[0],
+                prepare=self.revalidate(
+                    "/api/ingredients/?name=" + prefixes[0], "anon"
+                ),
+            ),
+            Scenario(
+                "ingredient detail",
+                "get",
+                [f"/api/ingredients/{pk}/" for pk, _ in self.ingredients],
+            ),
+            # Users
+            Scenario("users list anon", "get", "/api/users/"),
+            Scenario("users list auth", "get", "/api/users/", client="reader"),
+            Scenario(
+                "user detail",
+                "get",
+                f"/api/users/{self.author.pk}/",
+                client="reader",
+            ),
+            Scenario("users me", "get", "/api/users/me/", client="reader"),
+            Scenario(
+                "users me 304",
+                "get",
+                "/api/users/me/",
+                client="reader",
+                prepare=self.revalidate("/api/users/me/", "reader"),
+            ),
+            Scenario(
+                "subscriptions",
+                "get",
+                "/api/users/subscriptions/?recipes_limit=3",
+                client="reader",
+            ),
+            *self.toggle(
+                "subscribe", f"/api/users/{author}/subscribe/", "reader"
+            ),
+            *self.toggle(
+                "bulk subscribe", "/api/users/subscribe/", "reader", author_ids
+            ),
+            Scenario(
+                "user register",
+                "post",
+                "/api/users/",
+                data=lambda: self.registration(),
+                after=self.forget_registered,
+                writes=True,
+            ),
+            Scenario(
+                "set password",
+                "post",
+                "/api/users/set_password/",
+                client="guest",
+                data={
+                    "current_password": PASSWORD,
+                    "new_password": PASSWORD,
+                },
+                writes=True,
+            ),
+            Scenario(
+                "avatar upload",
+                "put",
+                "/api/users/me/avatar/",
+                client="guest",
+                data={"avatar": data_uri(image_bytes())},
+                writes=True,
+            ),
+            Scenario(
+                "avatar delete",
+                "delete",
+                "/api/users/me/avatar/",
+                client="guest",
+                before=self.upload_avatar,
+                writes=True,
+            ),
+            Scenario(
+                "token login",
+                "post",
+                "/api/auth/token/login/",
+                data={"email": self.guest.email, "password": PASSWORD},
+                writes=True,
+            ),
+            Scenario(
+                "token logout",
+                "post",
+                "/api/auth/token/logout/",
+                before=self.login_guest,
+                writes=True,
+            ),
+        ]
+
+    def toggle(self, name, path, client, data=None):
+        """Add and remove scenarios, each undoing the other untimed."""
+
+        def add(client_instance):
+            self.request(client_instance, "post", path, data)
+
+        def remove(client_instance, response=None):
+            self.request(client_instance, "delete", path, data)
+
+        return [
+            Scenario(
+                f"{name} add",
+                "post",
+                path,
+                client=client,
+                data=data,
+                after=remove,
+                writes=True,
+            ),
+            Scenario(
+                f"{name} remove",
+                "delete",
+                path,
+                client=client,
+                data=data,
+                before=add,
+                writes=True,
+            ),
+        ]
+
+    def revalidate(self, path, client):
+        """Send the ETag of a first response back with every request."""
+
+        def prepare():
+            response = self.clients[client].get(path)
+            if not response.has_header("ETag"):
+                raise CommandError(f"{path} не вернул ETag")
+            return {"HTTP_IF_NONE_MATCH": response["ETag"]}
+
+        return prepare
+
+    def delete_created(self, template):
+        def after(client, response):
+            if response.status_code == 201:
+                client.delete(template.format(response.json()["id"]))
+
+        return after
+
+    def create_first(self, path, data):
+        def before(client):
+            response = self.request(client, "post", path, data)
+            return {"created": response.json()["id"]}
+
+        return before
+
+    def registration(self):
+        suffix = uuid.uuid4().hex[:10]
+        return {
+            "email": f"bench_{suffix}@example.com",
+            "username": f"bench_{suffix}",
+            "first_name": "Benchmark",
+            "last_name": "User",
+            "password": PASSWORD,
+        }
+
+    def forget_registered(self, client, response):
+        if response.status_code == 201:
+            self.registered.append(response.json()["id"])
+
+    def upload_avatar(self, client):
+        self.request(
+            client,
+            "put",
+            "/api/users/me/avatar/",
+            {"avatar": data_uri(image_bytes())},
+        )
+
+    def login_guest(self, client):
+        response = self.request(
+            client,
+            "post",
+            "/api/auth/token/login/",
+            {"email": self.guest.email, "password": PASSWORD},
+        )
+        return {"HTTP_AUTHORIZATION": f"Token {response.json()['auth_token']}"}
+
+    def request(
+        self,
+        client,
+        method,
+        path,
+        data=None,
+        content_type="application/json",
+        **headers,
+    ):
+        kwargs = dict(headers)
+        if data is not None:
+            if content_type == MULTIPART_CONTENT and method != "post":
+                # Only Client.post() encodes multipart bodies itself.
+                data = encode_multipart(BOUNDARY, data)
+            kwargs["data"] = data
+            kwargs["content_type"] = content_type
+        response = getattr(client, method)(path, **kwargs)
+        if response.streaming:
+            # The body is produced while it is consumed.
+            response.body_size = sum(map(len, response.streaming_content))
+        else:
+            response.body_size = len(response.content)
+        return response
+
+    def run(self, scenario, iterations, warmup):
+        with scenario.context():
+            return self.measure(scenario, iterations, warmup)
+
+    def measure(self, scenario, iterations, warmup):
+        client = self.clients[scenario.client]
+        headers = dict(scenario.headers)
+        if scenario.prepare is not None:
+            headers.update(scenario.prepare())
+        durations = []
+        queries = []
+        body_sizes = []
+        serialize = []
+        statuses = set()
+        for index in range(warmup + iterations):
+            request_headers = dict(headers)
+            path = scenario.paths[index % len(scenario.paths)]
+            if scenario.before is not None:
+                extra = scenario.before(client) or {}
+                if "created" in extra:
+                    path = path.format(created=extra.pop("created"))
+                request_headers.update(extra)
+            data = scenario.data
+            if callable(data):
+                data = data()
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = self.request(
+                    client,
+                    scenario.method,
+                    path,
+                    data,
+                    scenario.content_type,
+                    **request_headers,
+                )
+                duration = time.perf_counter() - started
+            if scenario.after is not None:
+                scenario.after(client, response)
+            if index < warmup:
+                continue
+            durations.append(duration * 1000)
+            queries.append(counter.count)
+            body_sizes.append(response.body_size)
+            statuses.add(response.status_code)
+            timing = SERIALIZE_TIMING.search(response.get("Server-Timing", ""))
+            if timing:
+                serialize.append(float(timing.group(1)))
+        result = {
+            "name": scenario.name,
+            "method": scenario.method.upper(),
+            "path": scenario.paths[0],
+            "client": scenario.client,
+            "statuses": sorted(statuses),
+            "iterations": iterations,
+            "latency_ms": {
+                **{
+                    f"p{rank}": round(percentile(durations, rank), 3)
+                    for rank in PERCENTILES
+                },
+                "mean": round(statistics.mean(durations), 3),
+                "min": round(min(durations), 3),
+                "max": round(max(durations), 3),
+            },
+            "queries": {
+                "median": statistics.median(queries),
+                "max": max(queries),
+            },
+            "bytes": {
+                "median": statistics.median(body_sizes),
+                "max": max(body_sizes),
+            },
+            **scenario.extra,
+        }
+        if serialize:
+            result["serialize_ms"] = {"median": statistics.median(serialize)}
+        self.stdout.write(
+            f"{scenario.name:<32} {result['latency_ms']['p50']:>9.2f} "
+            f"{result['latency_ms']['p99']:>9.2f} мс "
+            f"{result['queries']['median']:>5} SQL "
+            f"{result['bytes']['median'] / 1024:>9.1f} КБ  "
+            f"{result['statuses']}"
+        )
+        if scenario.budget_ms is not None:
+            result["budget_ms"] = scenario.budget_ms
+            result["within_budget"] = (
+                result["latency_ms"]["p99"] <= scenario.budget_ms
+            )
+            if not result["within_budget"]:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{scenario.name}: p99 выше бюджета "
+                        f"{scenario.budget_ms:g} мс"
+                    )
+                )
+        return result
+
+    def metadata(self, options, elapsed):
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": self.git_revision(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": {
+                "vendor": connection.vendor,
+                "version": ".".join(
+                    map(str, connection.get_database_version())
+                ),
+            },
+            "cache": settings.CACHES["default"]["BACKEND"],
+            "dataset": {
+                model._meta.model_name: model.objects.count()
+                for model in (
+                    User,
+                    Recipe,
+                    Ingredient,
+                    RecipeIngredient,
+                    Favorite,
+                    ShoppingCart,
+                    ShoppingListItem,
+                    Follow,
+                    FeedEntry,
+                )
+            },
+            "iterations": options["iterations"],
+            "warmup": options["warmup"],
+            "elapsed_s": round(elapsed, 3),
+        }
+
+    def git_revision(self):
+        def git(*args):
+            try:
+                return subprocess.run(
+                    ["git", *args],
+                    cwd=settings.BASE_DIR,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout.strip()
+            except (OSError, subprocess.CalledProcessError):
+                return None
+
+        return {
+            "commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain")),
+        }
+
+    def compare(self, results, path):
+        try:
+            with open(path, encoding="utf-8") as file:
+                baseline = {
+                    result["name"]: result
+                    for result in json.load(file)["results"]
+                }
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f"Не удалось прочитать {path}: {error}")
+        self.stdout.write(f"Сравнение с {path} (p50, SQL, КБ):")
+        for result in results:
+            old = baseline.get(result["name"])
+            if old is None:
+                continue
+            before = old["latency_ms"]["p50"]
+            after = result["latency_ms"]["p50"]
+            change = (after - before) / before * 100 if before else 0
+            self.stdout.write(
+                f"{result['name']:<32} {before:>9.2f} -> {after:>9.2f} мс "
+                f"({change:+.0f}%)  {old['queries']['median']} -> "
+                f"{result['queries']['median']} SQL  "
+                f"{self.kilobytes(old)} -> {self.kilobytes(result)} КБ"
+            )
+
+    def kilobytes(self, result):
+        """Median body size; results saved before it was recorded lack it."""
+        if "bytes" not in result:
+            return "?"
+        return f"{result['bytes']['median'] / 1024:.1f}"
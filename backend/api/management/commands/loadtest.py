@@ -0,0 +1,366 @@
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from api.management.commands.benchmark import PERCENTILES, percentile
+from recipes.models import Ingredient, Recipe
+from users.models import User
+
+PAGE_SIZE = 6
+# Share of each endpoint in the generated traffic
+MIX = {"list": 4, "detail": 3, "ingredients": 2, "short_link": 1}
+# gunicorn command line and environment of each server
+SERVERS = {
+    "wsgi": (["foodgram.wsgi:application"], {"ASYNC_VIEWS": "False"}),
+    "asgi": (
+        [
+            "foodgram.asgi:application",
+            "--worker-class",
+            "uvicorn.workers.UvicornWorker",
+        ],
+        {"ASYNC_VIEWS": "True"},
+    ),
+}
+
+
+async def fetch(port, request, timeout):
+    """Send a raw request on a new connection and return the status.
+
+    A connection per request, as nginx opens to the backend without an
+    upstream keepalive.
+    """
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection("127.0.0.1", port), timeout
+    )
+    try:
+        writer.write(request)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ConnectionError("Malformed status line")
+    return int(parts[1])
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность gunicorn с синхронными "
+        "WSGI-воркерами и с ASGI-воркерами uvicorn (ASYNC_VIEWS) при "
+        "одновременных клиентах на горячих эндпоинтах чтения"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            nargs="+",
+            default=[50, 200, 1000],
+            help="Числа одновременных клиентов",
+        )
+        parser.add_argument(
+            "--servers",
+            nargs="+",
+            choices=list(SERVERS),
+            default=list(SERVERS),
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=15,
+            help="Секунд нагрузки на каждое число клиентов",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=float,
+            default=3,
+            help="Секунд прогрева каждого сервера",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Воркеров gunicorn, одинаково для обоих серверов",
+        )
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30,
+            help="Секунд ожидания ответа, дольше - ошибка",
+        )
+        parser.add_argument(
+            "--authenticated",
+            action="store_true",
+            help="Запросы с токеном самого активного подписчика",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--output",
+            help="Файл результатов (по умолчанию loadtest-<время>.json)",
+        )
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError(
+                "В базе нет рецептов, сначала выполните generate_fake_data"
+            )
+        self.raise_file_limit(max(options["concurrency"]))
+        host = next(
+            (
+                host
+                for host in settings.ALLOWED_HOSTS
+                if host != "*" and not host.startswith(".")
+            ),
+            "localhost",
+        )
+        headers = f"Host: {host}\r\nConnection: close\r\n"
+        if options["authenticated"]:
+            headers += f"Authorization: Token {self.reader_token()}\r\n"
+        requests = [
+            f"GET {path} HTTP/1.1\r\n{headers}\r\n".encode()
+            for path in self.paths(random.Random(options["seed"]))
+        ]
+        results = []
+        for server in options["servers"]:
+            process = self.start(server, options)
+            try:
+                self.stdout.write(f"\n{server}: прогрев")
+                asyncio.run(
+                    self.load(
+                        options["port"],
+                        requests,
+                        min(options["concurrency"]),
+                        options["warmup"],
+                        options["timeout"],
+                    )
+                )
+                for clients in options["concurrency"]:
+                    result = asyncio.run(
+                        self.load(
+                            options["port"],
+                            requests,
+                            clients,
+                            options["duration"],
+                            options["timeout"],
+                        )
+                    )
+                    result = {"server": server, "clients": clients, **result}
+                    self.report(result)
+                    results.append(result)
+            finally:
+                self.stop(process)
+        self.summary(results, options)
+        output = options["output"] or "loadtest-{}.json".format(
+            datetime.now().strftime("%Y%m%d-%H%M%S")
+        )
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(
+                {"meta": self.metadata(options), "results": results},
+                file,
+                ensure_ascii=False,
+                indent=2,
+            )
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {output}"))
+
+    def raise_file_limit(self, clients):
+        """Each client holds a socket here and one in the server."""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = clients * 2 + 256
+        if soft >= needed:
+            return
+        if hard != resource.RLIM_INFINITY and hard < needed:
+            raise CommandError(
+                f"Нужно {needed} файловых дескрипторов, доступно {hard}"
+            )
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+    def reader_token(self):
+        reader = (
+            User.objects.annotate(follows=Count("follower"))
+            .order_by("-follows")
+            .first()
+        )
+        token, _ = Token.objects.get_or_create(user=reader)
+        return token.key
+
+    def paths(self, generator, count=2000):
+        """The request paths of the traffic mix, in a fixed random order."""
+        recipe_ids = list(Recipe.objects.values_list("pk", flat=True))
+        pages = max(1, math.ceil(len(recipe_ids) / PAGE_SIZE))
+        prefixes = sorted(
+            {
+                name[:2]
+                for name in Ingredient.objects.values_list("name", flat=True)
+                if len(name) >= 2
+            }
+        )
+        make = {
+            # Most reads are of the first pages.
+            "list": lambda: "/api/recipes/?page={}".format(
+                min(pages, int(generator.paretovariate(1.2)))
+            ),
+            "detail": lambda: f"/api/recipes/{generator.choice(recipe_ids)}/",
+            "ingredients": lambda: "/api/ingredients/?name={}".format(
+                quote(generator.choice(prefixes))
+            ),
+            "short_link": lambda: f"/r/{generator.choice(recipe_ids)}/",
+        }
+        kinds = generator.choices(
+            list(MIX), weights=list(MIX.values()), k=count
+        )
+        return [make[kind]() for kind in kinds]
+
+    def start(self, server, options):
+        arguments, environment = SERVERS[server]
+        self.log = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                *arguments,
+                "--config",
+                os.path.join(settings.BASE_DIR, "gunicorn.conf.py"),
+                "--bind",
+                f"127.0.0.1:{options['port']}",
+                "--workers",
+                str(options["workers"]),
+                "--backlog",
+                str(max(2048, max(options["concurrency"]))),
+            ],
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                **environment,
+                # A log line per request would load the CPU being measured.
+                "INSTRUMENTATION_LOG_LEVEL": "WARNING",
+            },
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        probe = (
+            b"GET /api/ingredients/ HTTP/1.1\r\n"
+            b"Host: localhost\r\nConnection: close\r\n\r\n"
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                break
+            try:
+                asyncio.run(fetch(options["port"], probe, 5))
+                return process
+            except (OSError, asyncio.TimeoutError):
+                time.sleep(0.2)
+        self.stop(process)
+        self.log.seek(0)
+        raise CommandError(
+            f"{server} не запустился:\n"
+            + self.log.read().decode(errors="replace")[-2000:]
+        )
+
+    def stop(self, process):
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    async def load(self, port, requests, clients, duration, timeout):
+        latencies = []
+        statuses = Counter()
+        errors = Counter()
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def client(offset):
+            index = offset
+            while time.perf_counter() < deadline:
+                request = requests[index % len(requests)]
+                index += clients
+                request_started = time.perf_counter()
+                try:
+                    status = await fetch(port, request, timeout)
+                except (OSError, asyncio.TimeoutError) as error:
+                    errors[type(error).__name__] += 1
+                    # Refused connections would otherwise spin.
+                    await asyncio.sleep(0.05)
+                    continue
+                latencies.append(time.perf_counter() - request_started)
+                statuses[status] += 1
+
+        await asyncio.gather(*(client(offset) for offset in range(clients)))
+        elapsed = time.perf_counter() - started
+        result = {
+            "requests": len(latencies),
+            "elapsed_s": round(elapsed, 3),
+            "rps": round(len(latencies) / elapsed, 1),
+            "statuses": {str(code): n for code, n in sorted(statuses.items())},
+            "errors": dict(errors),
+        }
+        if latencies:
+            latencies_ms = [latency * 1000 for latency in latencies]
+            result["latency_ms"] = {
+                f"p{rank}": round(percentile(latencies_ms, rank), 1)
+                for rank in PERCENTILES
+            }
+        return result
+
+    def report(self, result):
+        latency = result.get("latency_ms", {})
+        failed = sum(result["errors"].values()) + sum(
+            n
+            for code, n in result["statuses"].items()
+            if int(code) >= 500
+        )
+        self.stdout.write(
+            f"{result['clients']:>6} клиентов {result['rps']:>9.1f} rps  "
+            + "  ".join(
+                f"p{rank} {latency.get(f'p{rank}', 0):>8.1f}"
+                for rank in PERCENTILES
+            )
+            + f" мс  ошибок {failed}"
+        )
+
+    def summary(self, results, options):
+        if len(options["servers"]) < 2:
+            return
+        by_key = {(r["server"], r["clients"]): r for r in results}
+        self.stdout.write("\nклиентов   wsgi rps   asgi rps   asgi/wsgi")
+        for clients in options["concurrency"]:
+            wsgi = by_key[("wsgi", clients)]["rps"]
+            asgi = by_key[("asgi", clients)]["rps"]
+            ratio = f"{asgi / wsgi:>10.2f}" if wsgi else f"{'-':>10}"
+            self.stdout.write(
+                f"{clients:>8} {wsgi:>10.1f} {asgi:>10.1f}{ratio}"
+            )
+
+    def metadata(self, options):
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "cpus": os.cpu_count(),
+            "workers": options["workers"],
+            "duration_s": options["duration"],
+            "authenticated": options["authenticated"],
+            "mix": MIX,
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "recipes": Recipe.objects.count(),
+        }
@@ -0,0 +1,134 @@
+import glob
+import os
+import pstats
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Frames reported separately: where serialization and the ORM spend time
+CATEGORIES = {
+    "serializer": (
+        "rest_framework/serializers.py",
+        "rest_framework/fields.py",
+        "rest_framework/relations.py",
+        "api/serializers.py",
+    ),
+    "orm": ("django/db/",),
+}
+
+
+def category(label):
+    for name, markers in CATEGORIES.items():
+        if any(marker in label for marker in markers):
+            return name
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Объединяет профили из PROFILING_DIR в один файл для flamegraph и "
+        "показывает самые горячие функции сериализаторов и ORM"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dir",
+            default=None,
+            help="Каталог профилей (по умолчанию PROFILING_DIR)",
+        )
+        parser.add_argument(
+            "--view",
+            default="",
+            help="Только профили представления, например RecipeViewSet.list",
+        )
+        parser.add_argument(
+            "--output",
+            help="Куда записать объединённый профиль "
+            "(.collapsed для flamegraph.pl/speedscope или .prof)",
+        )
+        parser.add_argument(
+            "--top", type=int, default=15, help="Сколько функций показывать"
+        )
+
+    def handle(self, *args, **options):
+        directory = options["dir"] or settings.PROFILING_DIR
+        pattern = os.path.join(directory, f"{options['view']}*")
+        collapsed = sorted(glob.glob(f"{pattern}.collapsed"))
+        profiles = sorted(glob.glob(f"{pattern}.prof"))
+        if not collapsed and not profiles:
+            raise CommandError(f"В {directory} нет подходящих профилей")
+        output = options["output"]
+        if collapsed:
+            self.report_samples(collapsed, options["top"], output)
+        if profiles:
+            self.report_pstats(profiles, options["top"], output)
+
+    def report_samples(self, paths, top, output):
+        stacks = Counter()
+        for path in paths:
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack and count.isdigit():
+                        stacks[stack] += int(count)
+        total = sum(stacks.values())
+        inclusive = Counter()
+        own = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            # Recursive frames are counted once per stack.
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(f"Профилей: {len(paths)}, выборок: {total}")
+        # Overall by self time: every frame above the view is 100% inclusive.
+        for name, ranking in (("self", own), *(
+            (name, inclusive) for name in CATEGORIES
+        )):
+            self.stdout.write(f"\n{name}: inclusive % / self %")
+            frames = [
+                frame
+                for frame, _ in ranking.most_common()
+                if name == "self" or category(frame) == name
+            ][:top]
+            for frame in frames:
+                self.stdout.write(
+                    f"{inclusive[frame] / total:>7.1%} "
+                    f"{own[frame] / total:>7.1%}  {frame}"
+                )
+        if output and output.endswith(".collapsed"):
+            with open(output, "w", encoding="utf-8") as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+            self.stdout.write(self.style.SUCCESS(f"Записано: {output}"))
+
+    def report_pstats(self, paths, top, output):
+        stats = pstats.Stats(*paths, stream=self.stdout)
+        self.stdout.write(f"\nФайлов pstats: {len(paths)}")
+        rows = sorted(
+            (
+                (cumulative, own_time, calls, f"{file}:{line}({function})")
+                for (file, line, function), (
+                    _,
+                    calls,
+                    own_time,
+                    cumulative,
+                    _,
+                ) in stats.stats.items()
+            ),
+            reverse=True,
+        )
+        for name in (None, *CATEGORIES):
+            title = name or "all"
+            self.stdout.write(f"\n{title}: cumulative s / own s / calls")
+            selected = [
+                row for row in rows if name is None or category(row[3]) == name
+            ][:top]
+            for cumulative, own_time, calls, label in selected:
+                self.stdout.write(
+                    f"{cumulative:>9.4f} {own_time:>9.4f} {calls:>8}  {label}"
+                )
+        if output and output.endswith(".prof"):
+            stats.dump_stats(output)
+            self.stdout.write(self.style.SUCCESS(f"Записано: {output}"))
@@ -0,0 +1,126 @@
+"""Prometheus metrics of the API and the ``/metrics`` endpoint.
+
+Under gunicorn set ``PROMETHEUS_MULTIPROC_DIR`` to an empty directory
+shared by the workers: every process then writes its samples to mmap
+files there and ``/metrics`` sums them, whichever worker is scraped.
+``gunicorn.conf.py`` drops the files of workers that exit.
+"""
+import ipaddress
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "foodgram_request_duration_seconds",
+    "Time to the first response byte, by view and action",
+    ["view", "action"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSES = Counter(
+    "foodgram_responses_total",
+    "Responses by view, action and status code",
+    ["view", "action", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "foodgram_request_queries",
+    "SQL statements per request, by view and action",
+    ["view", "action"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "foodgram_requests_in_progress",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+DB_CONNECTIONS = Gauge(
+    "foodgram_db_connections",
+    "Open database connections, as left by the last request",
+    multiprocess_mode="livesum",
+)
+RECIPE_CACHE = Counter(
+    "foodgram_recipe_cache_lookups_total",
+    "Serialized recipe cache lookups",
+    ["result"],
+)
+
+
+# Labelled children by label values: labels() costs more than observe()
+_children = {}
+
+
+def _child(metric, *labels):
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def split_view(view_name):
+    """``RecipeViewSet.list`` -> ``("RecipeViewSet", "list")``."""
+    if view_name is None:
+        # Unresolved URLs share one label instead of one per path.
+        return "unmatched", ""
+    view, _, action = view_name.rpartition(".")
+    if not view:
+        return action, ""
+    return view, action
+
+
+def observe_request(view_name, status, duration, query_count, databases):
+    """Record a request; ``databases`` are the connections it could use.
+
+    ``databases`` is ``None`` for async requests, which leave the gauge
+    as it is.
+    """
+    view, action = split_view(view_name)
+    _child(REQUEST_LATENCY, view, action).observe(duration)
+    _child(RESPONSES, view, action, str(status)).inc()
+    _child(REQUEST_QUERIES, view, action).observe(query_count)
+    if databases is not None:
+        DB_CONNECTIONS.set(
+            sum(database.connection is not None for database in databases)
+        )
+
+
+def observe_recipe_cache(hits, misses):
+    if hits:
+        _child(RECIPE_CACHE, "hit").inc(hits)
+    if misses:
+        _child(RECIPE_CACHE, "miss").inc(misses)
+
+
+def _allowed(request):
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") == f"Bearer {token}":
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(address in network for network in settings.METRICS_NETWORKS)
+
+
+def metrics_view(request):
+    """Metrics in the Prometheus text format, for internal scrapers only."""
+    if not _allowed(request):
+        raise Http404
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
@@ -0,0 +1,163 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Keyset (cursor) pagination over a unique ordering.
+
+    Pages are selected with a ``WHERE (a, b) < (x, y)`` style condition on
+    the ordering fields instead of ``OFFSET``, so every page costs the same
+    index range scan. The count query only runs with ``?with_count=1``.
+    Querysets already ordered otherwise, by ``?ordering=`` or a search
+    rank, are rejected: their pages cannot follow the keyset.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Некорректный курсор."
+    ordering_conflict_message = (
+        "Курсорная пагинация не поддерживает другую сортировку, "
+        "используйте постраничную."
+    )
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_query = self.page_query(queryset, request)
+        if self.wants_count():
+            self.count = queryset.count()
+        return self.take_page(list(page_query))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` on the async ORM."""
+        page_query = self.page_query(queryset, request)
+        if self.wants_count():
+            self.count = await queryset.acount()
+        return self.take_page([row async for row in page_query])
+
+    def page_query(self, queryset, request):
+        """Return the query of the requested page and one more row."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.count = None
+        self.position, self.reverse = self.decode_cursor(
+            request, queryset.model
+        )
+        ordering = self.ordering
+        if queryset.query.order_by and tuple(
+            queryset.query.order_by
+        ) != tuple(ordering):
+            raise ValidationError(
+                {self.cursor_query_param: [self.ordering_conflict_message]}
+            )
+        if self.reverse:
+            ordering = [self.flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.after(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def wants_count(self):
+        return self.request.query_params.get("with_count") == "1"
+
+    def take_page(self, rows):
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def after(ordering, position):
+        """Build the condition selecting rows past ``position``.
+
+        ``a < x OR (a = x AND b < y)`` is ANDed with ``a <= x``, a bound
+        on the leading field alone that the database can turn into an
+        index range scan starting at the cursor.
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = {f"{name}__{lookup}": position[index]}
+            for previous, value in zip(ordering[:index], position):
+                condition[previous.lstrip("-")] = value
+            conditions.append(Q(**condition))
+        first = ordering[0]
+        bound = Q(
+            **{
+                f"{first.lstrip('-')}__"
+                f"{'lte' if first.startswith('-') else 'gte'}": position[0]
+            }
+        )
+        return bound & reduce(or_, conditions)
+
+    def encode_cursor(self, instance, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip("-"))
+            # Full precision: DjangoJSONEncoder drops microseconds.
+            if hasattr(value, "isoformat"):
+                value = value.isoformat()
+            position.append(value)
+        payload = json.dumps({"p": position, "r": reverse})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            remove_query_param(self.base_url, "with_count"),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(payload["p"]) != len(self.ordering):
+                raise ValueError("Cursor does not match the ordering")
+            position = [
+                model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, payload["p"])
+            ]
+            return position, bool(payload["r"])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
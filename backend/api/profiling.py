@@ -0,0 +1,160 @@
+"""Opt-in profiling of API views.
+
+A request is profiled when its view is listed in ``PROFILING_VIEWS``
+(``RecipeViewSet`` or ``RecipeViewSet.list``) and wins the
+``PROFILING_SAMPLE_RATE`` draw, or when a staff user sends the
+``X-Profile`` header. Profiles are written to ``PROFILING_DIR``: collapsed
+stacks from a sampling thread, or pstats files with
+``PROFILING_MODE = "cprofile"``. Only the newest ``PROFILING_MAX_FILES``
+are kept. ``manage.py profile_report`` merges them. GET requests served
+by ``api.async_views`` are not profiled.
+"""
+import cProfile
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = "HTTP_X_PROFILE"
+EXTENSIONS = {"sample": ".collapsed", "cprofile": ".prof"}
+
+
+def frame_label(code):
+    """``package/module.py:function`` for a code object."""
+    filename = code.co_filename
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        filename = filename.rsplit(marker, 1)[1]
+    elif filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    return f"{filename}:{code.co_name}"
+
+
+class StackSampler:
+    """Collect the stacks of one thread from a background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profiling-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.items():
+                file.write(f"{stack} {count}\n")
+
+
+class CProfileSampler:
+    """cProfile with the ``StackSampler`` interface."""
+
+    def __init__(self, interval):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {"sample": StackSampler, "cprofile": CProfileSampler}
+
+
+def wants_profile(request, view_name):
+    """Whether to profile the request; cheap when profiling is off."""
+    if HEADER in request.META:
+        return bool(request.user and request.user.is_staff)
+    views = settings.PROFILING_VIEWS
+    if not views:
+        return False
+    if view_name not in views and view_name.split(".")[0] not in views:
+        return False
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def rotate(directory, keep):
+    """Delete all but the newest ``keep`` profiles of ``directory``."""
+    entries = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def save(profiler, view_name):
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = "{}-{}-{}{}".format(
+        view_name,
+        int(time.time() * 1000),
+        uuid.uuid4().hex[:8],
+        EXTENSIONS[settings.PROFILING_MODE],
+    )
+    try:
+        profiler.write(os.path.join(directory, name))
+        rotate(directory, settings.PROFILING_MAX_FILES)
+    except OSError as error:
+        logger.warning("Cannot write profile %s: %s", name, error)
+
+
+class ProfilingMixin:
+    """Profile sampled requests of a viewset from auth to response."""
+
+    profiler = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication, so the header can be limited to staff.
+        view_name = f"{type(self).__name__}.{self.action}"
+        if wants_profile(request, view_name):
+            self.profiler = PROFILERS[settings.PROFILING_MODE](
+                settings.PROFILING_INTERVAL
+            )
+            self.profiler.start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self.profiler is not None:
+            self.profiler.stop()
+            save(self.profiler, f"{type(self).__name__}.{self.action}")
+            self.profiler = None
+        return response
@@ -0,0 +1,127 @@
+"""Cache of serialized recipes keyed by modification times.
+
+The user-independent part of each recipe representation is stored under
+a key built from ``updated_at`` of the recipe and of its author, which
+the page query loads anyway. Any change to a recipe, its ingredients or
+its author moves one of them, so stale entries are never read again and
+simply expire. The database is the only source of the key, so every
+process sees a change at once whatever cache backend is used. Per-user
+flags and the counters are taken from the page query and overlaid on
+every response.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+HITS_KEY = "recipe-cache:hits"
+MISSES_KEY = "recipe-cache:misses"
+# Query parameters changing the representation of the same recipe
+VARIANT_PARAMS = ("inline_images", "image_meta")
+
+
+def _stamp(moment):
+    return moment.strftime("%Y%m%d%H%M%S%f")
+
+
+def _variant(request):
+    params = "&".join(
+        f"{name}={request.query_params.get(name, '')}"
+        for name in VARIANT_PARAMS
+    )
+    base = request.build_absolute_uri("/")
+    return hashlib.sha256(f"{base}?{params}".encode()).hexdigest()[:12]
+
+
+def _count(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def stats():
+    """Return the hit and miss counters kept in the default cache.
+
+    With the per-process ``LocMemCache`` they only cover the current
+    process; the Prometheus metrics add up all workers.
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        "hits": counters.get(HITS_KEY, 0),
+        "misses": counters.get(MISSES_KEY, 0),
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def overlay(data, recipe, user):
+    """Replace per-user flags and counters with the current values."""
+    authenticated = user.is_authenticated
+    data["is_favorited"] = authenticated and bool(recipe.is_favorited)
+    data["is_in_shopping_cart"] = authenticated and bool(
+        recipe.is_in_shopping_cart
+    )
+    data["favorites_count"] = recipe.favorites_count
+    data["in_carts_count"] = recipe.in_carts_count
+    author = recipe.author
+    data["author"]["is_subscribed"] = (
+        authenticated
+        and author.pk != user.pk
+        and bool(recipe.author_is_subscribed)
+    )
+    data["author"]["recipes_count"] = author.recipes_count
+    data["author"]["followers_count"] = author.followers_count
+    return data
+
+
+def representations(recipes, request, serialize):
+    """Return the representations of ``recipes`` using the cache.
+
+    ``recipes`` come from the page query, with the author selected and
+    the per-user annotations. ``serialize(pks)`` returns fresh
+    representations of the recipes missing from the cache.
+
+    Returns the representations and the numbers of hits and misses.
+    """
+    variant = _variant(request)
+    keys = {
+        recipe.pk: "recipe-cache:entry:{}:{}:{}:{}".format(
+            recipe.pk,
+            _stamp(recipe.updated_at),
+            _stamp(recipe.author.updated_at),
+            variant,
+        )
+        for recipe in recipes
+    }
+    entries = cache.get_many(list(keys.values()))
+    missing = [pk for pk, key in keys.items() if key not in entries]
+    if missing:
+        fresh = {data["id"]: dict(data) for data in serialize(missing)}
+        cache.set_many(
+            {keys[pk]: data for pk, data in fresh.items()},
+            settings.RECIPE_CACHE_TIMEOUT,
+        )
+        for pk, data in fresh.items():
+            entries[keys[pk]] = data
+    hits = len(keys) - len(missing)
+    _count(HITS_KEY, hits)
+    _count(MISSES_KEY, len(missing))
+    metrics.observe_recipe_cache(hits, len(missing))
+    return (
+        [
+            overlay(entries[keys[recipe.pk]], recipe, request.user)
+            for recipe in recipes
+            # Skips recipes deleted after the page query.
+            if keys[recipe.pk] in entries
+        ],
+        hits,
+        len(missing),
+    )
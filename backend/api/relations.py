@@ -0,0 +1,69 @@
+"""Idempotent writes of per-user links: favorites, carts and follows.
+
+Each write is a single statement that reports which links it actually
+changed, so concurrent requests for the same pair neither fail on the
+unique constraint nor count a change twice. The writes bypass
+post_save and post_delete, so ``links_changed`` is sent instead.
+"""
+from django.db import connection
+
+from recipes.signals import links_changed
+
+
+def _names(model, owner_field, target_field):
+    quote = connection.ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.get_field(owner_field).column),
+        quote(model._meta.get_field(target_field).column),
+    )
+
+
+def add_links(model, owner_field, owner_id, target_field, target_ids):
+    """Link ``owner_id`` to the targets and return the newly linked ids.
+
+    ``INSERT ... ON CONFLICT DO NOTHING RETURNING``: pairs that already
+    exist are skipped by the database instead of a pre-check.
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    table, owner, target = _names(model, owner_field, target_field)
+    values = ", ".join(["(%s, %s)"] * len(target_ids))
+    params = []
+    for target_id in target_ids:
+        params.extend((owner_id, target_id))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({owner}, {target}) VALUES {values} "
+            f"ON CONFLICT DO NOTHING RETURNING {target}",
+            params,
+        )
+        added = {row[0] for row in cursor.fetchall()}
+    _send_changed(model, owner_id, added)
+    return added
+
+
+def remove_links(model, owner_field, owner_id, target_field, target_ids):
+    """Unlink ``owner_id`` from the targets and return the unlinked ids."""
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    table, owner, target = _names(model, owner_field, target_field)
+    placeholders = ", ".join(["%s"] * len(target_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE {owner} = %s "
+            f"AND {target} IN ({placeholders}) RETURNING {target}",
+            [owner_id, *target_ids],
+        )
+        removed = {row[0] for row in cursor.fetchall()}
+    _send_changed(model, owner_id, removed)
+    return removed
+
+
+def _send_changed(model, owner_id, target_ids):
+    if target_ids:
+        links_changed.send(
+            sender=model, owner_id=owner_id, target_ids=target_ids
+        )
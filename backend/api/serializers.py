@@ -1,21 +1,53 @@
 from rest_framework import serializers
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
 from djoser.serializers import (
     UserCreateSerializer as DjoserUserCreateSerializer
 )
 import base64
-import os
+import binascii
+import hashlib
+from urllib.parse import urlparse
 
-from users.models import User
-from recipes.models import Recipe, Ingredient, RecipeIngredient
+from PIL import Image
+
+from users.models import User, Follow
+from recipes.images import (
+    AVATAR_VARIANTS,
+    RECIPE_VARIANTS,
+    variant_urls,
+)
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from recipes.signals import recipe_ingredients_changed
 
 MIN_AMOUNT = 1
 MAX_AMOUNT = 32000
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32000
+IMAGE_FORMATS = ("png", "jpg", "jpeg")
+# Multiple of 4 so that every slice decodes on its own
+BASE64_CHUNK_SIZE = 64 * 1024
+MAX_DATA_URI_HEADER = 64
 
 
 class Base64ImageField(serializers.ImageField):
+    """Image field accepting data URIs and returning media URLs.
+
+    Images are represented by their media URL so that the web server can
+    serve the bytes and clients can cache them. ``?inline_images=1``
+    restores data URIs for files up to ``INLINE_IMAGE_MAX_SIZE`` bytes and
+    ``?image_meta=1`` returns the URL together with the image dimensions
+    and content hash.
+    """
+
     def __init__(self, *args, **kwargs):
         kwargs["allow_null"] = True
         super().__init__(*args, **kwargs)
@@ -25,37 +57,196 @@ class Base64ImageField(serializers.ImageField):
             return None
         if not data or (isinstance(data, str) and not data.strip()):
             raise serializers.ValidationError("Это поле не может быть пустым.")
+        if isinstance(data, str) and not data.startswith("data:image"):
+            if urlparse(data).path.startswith(settings.MEDIA_URL):
+                # The client sent back the URL it received: keep the image.
+                raise serializers.SkipField()
         if isinstance(data, str) and data.startswith("data:image"):
+            upload = self.decode_data_uri(data)
+            self.close_with_request(upload)
             try:
-                format, imgstr = data.split(";base64,")
-                ext = format.split("/")[-1]
-                if ext not in ["png", "jpg", "jpeg"]:
-                    raise serializers.ValidationError(
-                        "Неподдерживаемый формат изображения"
-                    )
-                data = ContentFile(
-                    base64.b64decode(imgstr), name=f"image.{ext}"
-                )
-            except Exception as e:
-                raise serializers.ValidationError(
-                    f"Ошибка декодирования Base64: {e}"
-                )
+                self.check_limits(upload)
+                super().to_internal_value(upload)
+            except serializers.ValidationError:
+                upload.close()
+                raise
+            return self.existing_file(upload)
+        if hasattr(data, "size"):
+            self.check_limits(data)
         return super().to_internal_value(data)
 
+    def close_with_request(self, upload):
+        """Close the decoded file at the end of the request.
+
+        It is added to the Django request's ``FILES``, which the handler
+        closes after the response like any other upload.
+        """
+        request = self.context.get("request")
+        if request is not None:
+            request._request.FILES.appendlist(self.field_name, upload)
+
+    def existing_file(self, upload):
+        """Return the stored name if the same bytes are already stored.
+
+        Names are content hashes, so an existing file is this image; the
+        upload is then not saved a second time under a suffixed name.
+        """
+        model_field = self.parent.Meta.model._meta.get_field(self.source)
+        name = model_field.generate_filename(None, upload.name)
+        if not model_field.storage.exists(name):
+            return upload
+        upload.close()
+        return name
+
+    def decode_data_uri(self, data):
+        """Decode a data URI chunk by chunk into a temporary upload file.
+
+        The decoded size is checked before decoding starts and the bytes
+        go straight to disk, so only the base64 text itself is held in
+        memory.
+        """
+        format, separator, _ = data[:MAX_DATA_URI_HEADER].partition(
+            ";base64,"
+        )
+        ext = format.split("/")[-1]
+        if not separator:
+            raise serializers.ValidationError(
+                "Ошибка декодирования Base64: ожидается data URI в base64."
+            )
+        if ext not in IMAGE_FORMATS:
+            raise serializers.ValidationError(
+                "Неподдерживаемый формат изображения"
+            )
+        # Slice the payload out of ``data`` piece by piece instead of
+        # copying the whole base64 text.
+        offset = len(format) + len(separator)
+        size = (len(data) - offset) * 3 // 4 - data[-2:].count("=")
+        if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                "Размер изображения не должен превышать "
+                f"{settings.MAX_IMAGE_UPLOAD_SIZE} байт."
+            )
+        upload = TemporaryUploadedFile(
+            f"image.{ext}", f"image/{ext}", size, None
+        )
+        digest = hashlib.sha256()
+        try:
+            for start in range(offset, len(data), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE], validate=True
+                )
+                digest.update(chunk)
+                upload.write(chunk)
+        except (binascii.Error, ValueError) as e:
+            upload.close()
+            raise serializers.ValidationError(
+                f"Ошибка декодирования Base64: {e}"
+            )
+        upload.seek(0)
+        upload.name = f"{digest.hexdigest()[:32]}.{ext}"
+        return upload
+
+    def check_limits(self, file):
+        """Reject oversized files and pixel bombs from the image header."""
+        if file.size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                "Размер изображения не должен превышать "
+                f"{settings.MAX_IMAGE_UPLOAD_SIZE} байт."
+            )
+        try:
+            file.seek(0)
+            with Image.open(file) as image:
+                pixels = image.width * image.height
+                image_format = image.format
+                image.verify()
+        except Exception:
+            raise serializers.ValidationError(
+                "Загрузите корректное изображение."
+            )
+        finally:
+            file.seek(0)
+        if image_format not in ("PNG", "JPEG"):
+            raise serializers.ValidationError(
+                "Неподдерживаемый формат изображения"
+            )
+        if pixels > settings.MAX_IMAGE_PIXELS:
+            raise serializers.ValidationError(
+                "Изображение не должно превышать "
+                f"{settings.MAX_IMAGE_PIXELS} пикселей."
+            )
+
     def to_representation(self, value):
         if not value or not value.name:
             return None
-        if not os.path.exists(value.path):
-            return None
+        request = self.context.get("request")
+        params = request.query_params if request else {}
+        if params.get("inline_images") == "1":
+            encoded = self.encode_inline(value)
+            if encoded is not None:
+                return encoded
+        url = value.url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        if params.get("image_meta") == "1":
+            return self.describe(value, url)
+        return url
+
+    def encode_inline(self, value):
+        """Return the image as a data URI unless it is too large."""
         try:
-            with open(value.path, "rb") as image_file:
+            if value.size > settings.INLINE_IMAGE_MAX_SIZE:
+                return None
+            with value.open("rb") as image_file:
                 encoded_string = base64.b64encode(
                     image_file.read()
                 ).decode("utf-8")
-                ext = value.name.split(".")[-1]
-                return f"data:image/{ext};base64,{encoded_string}"
-        except Exception:
+        except (OSError, ValueError):
+            return None
+        ext = value.name.split(".")[-1]
+        return f"data:image/{ext};base64,{encoded_string}"
+
+    def describe(self, value, url):
+        """Return the image URL with its dimensions and content hash."""
+        try:
+            digest = hashlib.sha256()
+            with value.open("rb") as image_file:
+                for chunk in image_file.chunks():
+                    digest.update(chunk)
+            width, height = value.width, value.height
+        except (OSError, ValueError):
+            return {"url": url, "width": None, "height": None, "hash": None}
+        return {
+            "url": url,
+            "width": width,
+            "height": height,
+            "hash": digest.hexdigest(),
+        }
+
+
+class ImageVariantsField(serializers.Field):
+    """Read-only URLs of the resized WebP/JPEG variants of an image.
+
+    Until the worker pool has rendered the variants their URLs point to
+    the original image. The model records the image whose variants are
+    stored in ``<source>_with_variants``, so storage is not touched.
+    """
+
+    def __init__(self, variants, **kwargs):
+        self.variants = variants
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value or not value.name:
             return None
+        ready = getattr(value.instance, f"{self.source}_with_variants")
+        urls = variant_urls(value.name, self.variants, ready == value.name)
+        request = self.context.get("request")
+        if request is not None:
+            for formats in urls.values():
+                for ext, url in formats.items():
+                    formats[ext] = request.build_absolute_uri(url)
+        return urls
 
 
 class AvatarSerializer(serializers.ModelSerializer):
@@ -66,24 +257,6 @@ class AvatarSerializer(serializers.ModelSerializer):
         fields = ("avatar",)
         extra_kwargs = {"avatar": {"required": False}}
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        if instance.avatar and instance.avatar.file:
-            try:
-                with open(instance.avatar.path, "rb") as image_file:
-                    encoded_string = base64.b64encode(
-                        image_file.read()
-                    ).decode("utf-8")
-                    ext = instance.avatar.name.split(".")[-1]
-                    representation["avatar"] = (
-                        f"data:image/{ext};base64,{encoded_string}"
-                    )
-            except Exception:
-                representation["avatar"] = None
-        else:
-            representation["avatar"] = None
-        return representation
-
 
 class SetPasswordSerializer(serializers.Serializer):
     current_password = serializers.CharField(required=True)
@@ -138,6 +311,9 @@ class CustomUserCreateSerializer(DjoserUserCreateSerializer):
 
 class CustomUserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField(
+        source="avatar", variants=AVATAR_VARIANTS
+    )
 
     class Meta:
         model = User
@@ -149,7 +325,11 @@ class CustomUserSerializer(serializers.ModelSerializer):
             "email",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
+            "recipes_count",
+            "followers_count",
         )
+        read_only_fields = ("recipes_count", "followers_count")
 
     def get_is_subscribed(self, obj):
         request = self.context.get("request")
@@ -157,7 +337,12 @@ class CustomUserSerializer(serializers.ModelSerializer):
             return False
         if obj == request.user:
             return False
-        return request.user.followers.filter(following=obj).exists()
+        annotated = getattr(obj, "is_subscribed", None)
+        if annotated is not None:
+            return annotated
+        return Follow.objects.filter(
+            user=request.user, following=obj
+        ).exists()
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -191,6 +376,9 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField(
+        source="image", variants=RECIPE_VARIANTS
+    )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     cooking_time = serializers.IntegerField(
@@ -203,13 +391,17 @@ class RecipeSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "image",
+            "image_variants",
             "text",
             "ingredients",
             "cooking_time",
             "author",
             "is_favorited",
             "is_in_shopping_cart",
+            "favorites_count",
+            "in_carts_count",
         )
+        read_only_fields = ("favorites_count", "in_carts_count")
 
     def validate(self, data):
         if (
@@ -237,13 +429,21 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
             return False
-        return request.user.favorites.filter(recipe=obj).exists()
+        annotated = getattr(obj, "is_favorited", None)
+        if annotated is not None:
+            return annotated
+        return Favorite.objects.filter(user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
             return False
-        return request.user.shopping_carts.filter(recipe=obj).exists()
+        annotated = getattr(obj, "is_in_shopping_cart", None)
+        if annotated is not None:
+            return annotated
+        return ShoppingCart.objects.filter(
+            user=request.user, recipe=obj
+        ).exists()
 
     def _create_ingredients(self, recipe, ingredients_data):
         ingredients = [
@@ -255,13 +455,18 @@ class RecipeSerializer(serializers.ModelSerializer):
             for ingredient_data in ingredients_data
         ]
         RecipeIngredient.objects.bulk_create(ingredients)
+        recipe_ingredients_changed.send(
+            sender=RecipeIngredient, recipe_ids=[recipe.pk]
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("recipeingredient_set")
         recipe = Recipe.objects.create(**validated_data)
         self._create_ingredients(recipe, ingredients_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop("recipeingredient_set")
         instance.name = validated_data.get("name", instance.name)
@@ -271,21 +476,58 @@ class RecipeSerializer(serializers.ModelSerializer):
             "cooking_time", instance.cooking_time
         )
         instance.save()
-        instance.recipeingredient_set.all().delete()
-        self._create_ingredients(instance, ingredients_data)
+        # One shopping list refresh instead of one per replaced row
+        with ShoppingListItem.objects.deferred_refresh():
+            instance.recipeingredient_set.all().delete()
+            self._create_ingredients(instance, ingredients_data)
         return instance
 
 
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Replace a recipe image uploaded as a multipart file."""
+
+    image = Base64ImageField()
+    image_variants = ImageVariantsField(
+        source="image", variants=RECIPE_VARIANTS
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ("image", "image_variants")
+
+    def validate_image(self, value):
+        if value is None:
+            raise serializers.ValidationError("Это поле обязательно.")
+        return value
+
+    def update(self, instance, validated_data):
+        instance.image = validated_data["image"]
+        instance.save(update_fields=["image", "updated_at"])
+        return instance
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        metadata = self.fields["image"].describe(
+            instance.image, representation["image"]
+        )
+        representation["image"] = metadata.pop("url")
+        representation.update(metadata)
+        return representation
+
+
 class RecipeShortSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField(
+        source="image", variants=("card",)
+    )
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -300,12 +542,18 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             "recipes",
             "recipes_count",
         )
+        read_only_fields = ("recipes_count",)
 
     def get_is_subscribed(self, obj):
         return True
 
     def get_recipes(self, obj):
         request = self.context.get("request")
+        previews = getattr(obj, "recipe_previews", None)
+        if previews is not None:
+            return RecipeShortSerializer(
+                previews, many=True, context={"request": request}
+            ).data
         recipes = obj.recipes.all()
         recipes_limit = request.query_params.get(
             "recipes_limit"
@@ -319,5 +567,16 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             recipes, many=True, context={"request": request}
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Ids of the objects a bulk endpoint adds or removes."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, value):
+        # Duplicates are answered once, in the order of first appearance.
+        return list(dict.fromkeys(value))
@@ -0,0 +1,344 @@
+import csv
+import hashlib
+import logging
+import os
+import re
+import struct
+import zlib
+
+from django.conf import settings
+
+from recipes.models import ShoppingListItem
+
+from .truetype import TrueTypeFont
+
+logger = logging.getLogger(__name__)
+
+ROWS_CHUNK_SIZE = 2000
+# A4 in points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+PAGE_MARGIN = 40
+FONT_SIZE = 12
+LINE_HEIGHT = 18
+
+
+def shopping_list_rows(user):
+    """Yield aggregated ingredients of the user's cart sorted by name."""
+    return (
+        ShoppingListItem.objects.filter(user=user)
+        .values(
+            "ingredient__name",
+            "ingredient__measurement_unit",
+            "total_amount",
+        )
+        .order_by("ingredient__name", "ingredient__measurement_unit")
+        .iterator(chunk_size=ROWS_CHUNK_SIZE)
+    )
+
+
+def format_row(item):
+    return (
+        f"{item['ingredient__name']} "
+        f"({item['ingredient__measurement_unit']}) - "
+        f"{item['total_amount']}"
+    )
+
+
+def render_txt(rows):
+    first = True
+    for item in rows:
+        yield ("" if first else "\n") + format_row(item)
+        first = False
+
+
+class _Echo:
+    """File-like object returning what csv.writer writes into it."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(["name", "measurement_unit", "amount"])
+    for item in rows:
+        yield writer.writerow(
+            [
+                item["ingredient__name"],
+                item["ingredient__measurement_unit"],
+                item["total_amount"],
+            ]
+        )
+
+
+def _load_font():
+    try:
+        return TrueTypeFont.load(settings.SHOPPING_LIST_FONT)
+    except (OSError, ValueError, struct.error):
+        logger.warning(
+            "Font %s not readable, PDF text falls back to Helvetica "
+            "without Cyrillic glyphs",
+            settings.SHOPPING_LIST_FONT,
+        )
+        return None
+
+
+def _paginate(rows):
+    per_page = (PAGE_HEIGHT - 2 * PAGE_MARGIN) // LINE_HEIGHT
+    page = []
+    for item in rows:
+        page.append(format_row(item))
+        if len(page) == per_page:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+class _EmbeddedFont:
+    """Writes text as glyph ids of a TrueType font embedded at the end.
+
+    Only the glyphs the document used are kept in the embedded font, so
+    they are collected while pages are written.
+    """
+
+    objects = 5
+
+    def __init__(self, font):
+        self.font = font
+        self.used = {}
+
+    def encode(self, line):
+        glyphs = []
+        for char in line:
+            glyph = self.font.glyph_id(char)
+            self.used.setdefault(glyph, char)
+            glyphs.append(f"{glyph:04X}")
+        return f"<{''.join(glyphs)}>".encode()
+
+    def write(self, write_object, font_id):
+        cid_id, descriptor_id, file_id, unicode_id = range(
+            font_id + 1, font_id + 5
+        )
+        glyphs = sorted(self.used)
+        tag = "".join(
+            chr(65 + byte % 26)
+            for byte in hashlib.sha256(repr(glyphs).encode()).digest()[:6]
+        )
+        name = "{}+{}".format(
+            tag,
+            re.sub(
+                r"[^A-Za-z0-9-]",
+                "",
+                os.path.splitext(
+                    os.path.basename(settings.SHOPPING_LIST_FONT)
+                )[0],
+            ),
+        )
+        font = self.font
+        yield write_object(
+            font_id,
+            (
+                f"<< /Type /Font /Subtype /Type0 /BaseFont /{name} "
+                f"/Encoding /Identity-H /DescendantFonts [{cid_id} 0 R] "
+                f"/ToUnicode {unicode_id} 0 R >>"
+            ).encode(),
+        )
+        widths = " ".join(
+            f"{glyph} [{font.width(glyph)}]" for glyph in glyphs
+        )
+        yield write_object(
+            cid_id,
+            (
+                f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} "
+                f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) "
+                f"/Supplement 0 >> /FontDescriptor {descriptor_id} 0 R "
+                f"/CIDToGIDMap /Identity /W [{widths}] >>"
+            ).encode(),
+        )
+        bbox = " ".join(str(font.scale(value)) for value in font.bbox)
+        yield write_object(
+            descriptor_id,
+            (
+                f"<< /Type /FontDescriptor /FontName /{name} /Flags 32 "
+                f"/FontBBox [{bbox}] /ItalicAngle 0 "
+                f"/Ascent {font.scale(font.ascent)} "
+                f"/Descent {font.scale(font.descent)} "
+                f"/CapHeight {font.scale(font.ascent)} /StemV 80 "
+                f"/FontFile2 {file_id} 0 R >>"
+            ).encode(),
+        )
+        program = font.subset(glyphs)
+        data = zlib.compress(program)
+        yield write_object(
+            file_id,
+            (
+                f"<< /Length {len(data)} /Length1 {len(program)} "
+                f"/Filter /FlateDecode >>"
+            ).encode(),
+            data,
+        )
+        cmap = _to_unicode(
+            (glyph, char) for glyph, char in sorted(self.used.items())
+            if glyph
+        )
+        yield write_object(
+            unicode_id, f"<< /Length {len(cmap)} >>".encode(), cmap
+        )
+
+
+class _StandardFont:
+    """Helvetica, for when the TrueType font cannot be read."""
+
+    objects = 1
+
+    def encode(self, line):
+        text = line.encode("cp1252", "replace")
+        for char in (b"\\", b"(", b")"):
+            text = text.replace(char, b"\\" + char)
+        return b"(" + text + b")"
+
+    def write(self, write_object, font_id):
+        yield write_object(
+            font_id,
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+            b"/Encoding /WinAnsiEncoding >>",
+        )
+
+
+def _to_unicode(mapping):
+    """A ToUnicode CMap, so the text can be searched and copied."""
+    mapping = list(mapping)
+    lines = [
+        "/CIDInit /ProcSet findresource begin",
+        "12 dict begin",
+        "begincmap",
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) "
+        "/Supplement 0 >> def",
+        "/CMapName /Adobe-Identity-UCS def",
+        "/CMapType 2 def",
+        "1 begincodespacerange",
+        "<0000> <FFFF>",
+        "endcodespacerange",
+    ]
+    for start in range(0, len(mapping), 100):
+        chunk = mapping[start:start + 100]
+        lines.append(f"{len(chunk)} beginbfchar")
+        lines.extend(
+            "<{:04X}> <{}>".format(
+                glyph, char.encode("utf-16-be").hex().upper()
+            )
+            for glyph, char in chunk
+        )
+        lines.append("endbfchar")
+    lines.extend(
+        [
+            "endcmap",
+            "CMapName currentdict /CMapResource defineresource pop",
+            "end",
+            "end",
+        ]
+    )
+    return "\n".join(lines).encode()
+
+
+def _page_content(lines, font):
+    top = PAGE_HEIGHT - PAGE_MARGIN - FONT_SIZE
+    content = [
+        f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL "
+        f"{PAGE_MARGIN} {top} Td".encode()
+    ]
+    content.extend(font.encode(line) + b" Tj T*" for line in lines)
+    content.append(b"ET")
+    return b"\n".join(content)
+
+
+def render_pdf(rows):
+    """Write a PDF page by page so only one page is held in memory.
+
+    Lines are text drawn with the TrueType font of
+    ``SHOPPING_LIST_FONT``, which has Cyrillic glyphs. The font subset,
+    the page tree and the cross-reference table are written once all
+    pages are out.
+    """
+    truetype = _load_font()
+    font = _StandardFont() if truetype is None else _EmbeddedFont(truetype)
+    offsets = {}
+    page_ids = []
+    position = 0
+    # 1 is the catalog, 2 is the page tree, the font objects come next
+    font_id = 3
+    next_id = font_id + font.objects
+
+    def write_object(object_id, body, stream=None):
+        nonlocal position
+        offsets[object_id] = position
+        chunk = f"{object_id} 0 obj\n".encode() + body
+        if stream is not None:
+            chunk += b"\nstream\n" + stream + b"\nendstream"
+        chunk += b"\nendobj\n"
+        position += len(chunk)
+        return chunk
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position += len(header)
+    yield header
+
+    for lines in _paginate(rows):
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        content = zlib.compress(_page_content(lines, font))
+        yield write_object(
+            content_id,
+            f"<< /Length {len(content)} /Filter /FlateDecode >>".encode(),
+            content,
+        )
+        yield write_object(
+            page_id,
+            (
+                f"<< /Type /Page /Parent 2 0 R "
+                f"/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 {font_id} 0 R >> >> "
+                f"/Contents {content_id} 0 R >>"
+            ).encode(),
+        )
+        page_ids.append(page_id)
+
+    if not page_ids:
+        # An empty cart still produces a valid one-page document.
+        page_id = next_id
+        next_id += 1
+        yield write_object(
+            page_id,
+            (
+                f"<< /Type /Page /Parent 2 0 R "
+                f"/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] >>"
+            ).encode(),
+        )
+        page_ids.append(page_id)
+
+    yield from font.write(write_object, font_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    yield write_object(
+        2,
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode(),
+    )
+    yield write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    xref = [f"xref\n0 {next_id}\n", "0000000000 65535 f \n"]
+    xref.extend(
+        f"{offsets[object_id]:010d} 00000 n \n"
+        for object_id in range(1, next_id)
+    )
+    xref.append(
+        f"trailer\n<< /Size {next_id} /Root 1 0 R >>\n"
+        f"startxref\n{position}\n%%EOF\n"
+    )
+    yield "".join(xref).encode()
+
+
+EXPORT_FORMATS = {
+    "txt": (render_txt, "text/plain; charset=utf-8"),
+    "csv": (render_csv, "text/csv; charset=utf-8"),
+    "pdf": (render_pdf, "application/pdf"),
+}
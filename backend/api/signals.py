@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.signals import ingredients_changed
+
+from .ingredient_index import ingredient_index
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+def touch_recipes_using(ingredient_ids):
+    """Mark recipes using the ingredients as changed."""
+    Recipe.objects.filter(ingredients__in=ingredient_ids).update(
+        updated_at=Now()
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient_recipes(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes_using([instance.pk])
+
+
+@receiver(ingredients_changed)
+def invalidate_bulk_changed_ingredients(sender, ingredient_ids, **kwargs):
+    ingredient_index.invalidate()
+    touch_recipes_using(ingredient_ids)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    # Recipe serializer writes bulk_create() the rows along with a save of
+    # the recipe; this covers rows edited on their own.
+    Recipe.objects.filter(pk=instance.recipe_id).update(updated_at=Now())
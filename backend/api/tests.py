@@ -0,0 +1,459 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import tracemalloc
+import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.serializers import Base64ImageField
+from api.shopping_list import render_pdf
+from api.truetype import TrueTypeFont
+from recipes.models import (
+    Favorite,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from users.models import Follow, User
+
+
+def setUpModule():
+    # One JSON line per request would drown the test output.
+    logger = logging.getLogger("api.instrumentation")
+    unittest.addModuleCleanup(logger.setLevel, logger.level)
+    logger.setLevel(logging.WARNING)
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f"user{number}@example.com",
+        username=f"user{number}",
+        first_name="Имя",
+        last_name="Фамилия",
+        password="password",
+    )
+
+
+def create_recipes(authors, ingredients, count):
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=authors[number % len(authors)],
+            name=f"Рецепт {number}",
+            text="Описание",
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=2)
+            for ingredient in ingredients
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user(0)
+        cls.authors = [create_user(number) for number in range(1, 6)]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(SERVER_NAME="localhost")
+        self.client.force_authenticate(self.reader)
+
+
+class Base64ImageFieldTests(SimpleTestCase):
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=8 * 1024 * 1024)
+    def test_decoding_does_not_copy_the_payload(self):
+        payload = os.urandom(4 * 1024 * 1024)
+        data = "data:image/png;base64," + base64.b64encode(payload).decode()
+        tracemalloc.start()
+        try:
+            upload = Base64ImageField().decode_data_uri(data)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        with upload:
+            self.assertEqual(upload.read(), payload)
+        self.assertEqual(
+            upload.name, f"{hashlib.sha256(payload).hexdigest()[:32]}.png"
+        )
+        # The base64 text alone is 5.3 MB.
+        self.assertLess(peak, 1024 * 1024)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class AvatarDeleteTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def upload_avatar(self, client):
+        buffer = BytesIO()
+        Image.new("RGB", (32, 32), (200, 120, 40)).save(buffer, "PNG")
+        data = base64.b64encode(buffer.getvalue()).decode()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.put(
+                "/api/users/me/avatar/",
+                {"avatar": f"data:image/png;base64,{data}"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def delete_avatar(self, client):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.delete("/api/users/me/avatar/")
+        self.assertEqual(response.status_code, 204)
+
+    def test_shared_file_outlives_one_owner(self):
+        other = APIClient(SERVER_NAME="localhost")
+        other.force_authenticate(self.authors[0])
+        self.upload_avatar(self.client)
+        self.upload_avatar(other)
+        self.reader.refresh_from_db()
+        self.authors[0].refresh_from_db()
+        name = self.reader.avatar.name
+        self.assertEqual(self.authors[0].avatar.name, name)
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        self.delete_avatar(self.client)
+        self.assertTrue(os.path.exists(path))
+        self.delete_avatar(other)
+        self.assertFalse(os.path.exists(path))
+
+
+class DefaultAvatarTests(TestCase):
+    def test_default_avatar_is_not_resized(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_user(1)
+        self.assertEqual(callbacks, [])
+
+
+class RecipeQueryCountTests(APITestCase):
+    def assert_queries_per_size(self, number, url, sizes=(3, 12)):
+        for size in sizes:
+            recipes = create_recipes(self.authors, self.ingredients, size)
+            Favorite.objects.bulk_create(
+                Favorite(user=self.reader, recipe=recipe) for recipe in recipes
+            )
+            cache.clear()
+            with self.subTest(size=size), self.assertNumQueries(number):
+                response = self.client.get(url(recipes[-1]))
+            self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list(self):
+        self.assert_queries_per_size(5, lambda recipe: "/api/recipes/")
+
+    def test_recipe_detail(self):
+        self.assert_queries_per_size(
+            4, lambda recipe: f"/api/recipes/{recipe.pk}/"
+        )
+
+
+class IngredientSetFilterTests(APITestCase):
+    def test_empty_ids_are_ignored(self):
+        create_recipes(self.authors, self.ingredients, 2)
+        for param in ("ingredients_all", "ingredients_any", "pantry"):
+            for value in ("", ","):
+                with self.subTest(param=param, value=value):
+                    response = self.client.get(
+                        "/api/recipes/", {param: value}
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data["count"], 2)
+
+
+class SubscriptionQueryCountTests(APITestCase):
+    def test_count_ignores_recipes_limit_and_author_count(self):
+        create_recipes(self.authors, self.ingredients, 15)
+        for followed in (1, 5):
+            for author in self.authors[:followed]:
+                Follow.objects.get_or_create(
+                    user=self.reader, following=author
+                )
+            for query in ("", "?recipes_limit=1", "?recipes_limit=10"):
+                cache.clear()
+                with self.subTest(followed=followed, query=query):
+                    with self.assertNumQueries(3):
+                        response = self.client.get(
+                            f"/api/users/subscriptions/{query}"
+                        )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.data["results"]), followed)
+
+
+class RecipeETagTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = create_recipes(self.authors, self.ingredients, 1)[0]
+
+    def assert_etag_changes(self, url, change):
+        etag = self.client.get(url)["ETag"]
+        self.assertTrue(etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        return response
+
+    def urls(self):
+        return ("/api/recipes/", f"/api/recipes/{self.recipe.pk}/")
+
+    def test_recipe_change(self):
+        def change():
+            self.recipe.name = f"{self.recipe.name}!"
+            self.recipe.save()
+
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.assert_etag_changes(url, change)
+                self.assertIn(self.recipe.name, str(response.data))
+
+    def test_author_change(self):
+        author = self.recipe.author
+
+        def change():
+            author.first_name = f"{author.first_name}!"
+            author.save()
+
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.assert_etag_changes(url, change)
+                self.assertIn(author.first_name, str(response.data))
+
+    def test_counter_change(self):
+        other = APIClient(SERVER_NAME="localhost")
+        other.force_authenticate(self.authors[1])
+        author = self.recipe.author
+        updated_at = (self.recipe.updated_at, author.updated_at)
+
+        def change():
+            other.post(f"/api/users/{author.pk}/subscribe/")
+            other.post(f"/api/recipes/{self.recipe.pk}/favorite/")
+
+        url = f"/api/recipes/{self.recipe.pk}/"
+        response = self.assert_etag_changes(url, change)
+        self.assertEqual(response.data["favorites_count"], 1)
+        self.assertEqual(response.data["author"]["followers_count"], 1)
+        self.recipe.refresh_from_db()
+        author.refresh_from_db()
+        # The cached representation stays valid.
+        self.assertEqual(
+            (self.recipe.updated_at, author.updated_at), updated_at
+        )
+
+    def test_ingredient_change(self):
+        ingredient = self.ingredients[0]
+
+        def change():
+            ingredient.name = f"{ingredient.name}!"
+            ingredient.save()
+
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.assert_etag_changes(url, change)
+                self.assertIn(ingredient.name, str(response.data))
+
+
+class ConcurrentLinkTests(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            # Threads would share one in-memory database, which locks
+            # whole tables instead of waiting for the writer.
+            self.skipTest("set DB_TEST_NAME to a file for SQLite")
+        cache.clear()
+        self.reader = create_user(0)
+        self.author = create_user(1)
+        self.ingredient = Ingredient.objects.create(
+            name="Мука", measurement_unit="г"
+        )
+        self.recipes = create_recipes(
+            [self.author], [self.ingredient], self.workers
+        )
+        self.recipe = self.recipes[0]
+
+    def post_concurrently(self, urls):
+        if isinstance(urls, str):
+            urls = [urls] * self.workers
+
+        def post(url):
+            client = APIClient(SERVER_NAME="localhost")
+            client.force_authenticate(self.reader)
+            try:
+                return client.post(url).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return sorted(executor.map(post, urls))
+
+    def assert_shopping_list_total(self, amount):
+        self.assertEqual(
+            list(
+                ShoppingListItem.objects.filter(user=self.reader).values_list(
+                    "ingredient", "total_amount"
+                )
+            ),
+            [(self.ingredient.pk, amount)],
+        )
+
+    def assert_one_created(self, statuses):
+        self.assertEqual(statuses, [201] + [400] * (self.workers - 1))
+
+    def test_favorite(self):
+        self.assert_one_created(
+            self.post_concurrently(f"/api/recipes/{self.recipe.pk}/favorite/")
+        )
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        self.assert_one_created(
+            self.post_concurrently(
+                f"/api/recipes/{self.recipe.pk}/shopping_cart/"
+            )
+        )
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assert_shopping_list_total(2)
+
+    def test_shopping_cart_of_many_recipes(self):
+        statuses = self.post_concurrently(
+            [
+                f"/api/recipes/{recipe.pk}/shopping_cart/"
+                for recipe in self.recipes
+            ]
+        )
+        self.assertEqual(statuses, [201] * self.workers)
+        self.assertEqual(ShoppingCart.objects.count(), self.workers)
+        self.assert_shopping_list_total(2 * self.workers)
+
+    def test_follow(self):
+        self.assert_one_created(
+            self.post_concurrently(f"/api/users/{self.author.pk}/subscribe/")
+        )
+        self.assertEqual(Follow.objects.count(), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1, FEED_BACKFILL_WORKERS=0)
+class FeedBackfillTests(APITestCase):
+    def test_unfollow_backfills_after_commit(self):
+        author, follower = self.authors[:2]
+        recipes = create_recipes([author], self.ingredients, 3)
+        for user in (self.reader, follower):
+            client = APIClient(SERVER_NAME="localhost")
+            client.force_authenticate(user)
+            client.post(f"/api/users/{author.pk}/subscribe/")
+        self.assertFalse(FeedEntry.objects.filter(user=follower).exists())
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.delete(
+                f"/api/users/{author.pk}/subscribe/"
+            )
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(
+                FeedEntry.objects.filter(user=follower).exists()
+            )
+        self.assertTrue(callbacks)
+        self.assertCountEqual(
+            FeedEntry.objects.filter(user=follower).values_list(
+                "recipe", flat=True
+            ),
+            [recipe.pk for recipe in recipes],
+        )
+
+
+class BulkSubscribeTests(APITestCase):
+    def test_own_id_has_self_status(self):
+        ids = [self.reader.pk, self.authors[0].pk, 10**9]
+        for method, done in (("post", "added"), ("delete", "removed")):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(
+                    "/api/users/subscribe/", {"ids": ids}, format="json"
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [result["status"] for result in response.data["results"]],
+                    ["self", done, "not_found"],
+                )
+
+
+@override_settings(
+    INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_PUBLIC_TIMINGS=False
+)
+class ServerTimingTests(APITestCase):
+    def has_timings(self, client):
+        return client.get("/api/recipes/").has_header("Server-Timing")
+
+    def test_sent_to_staff_only(self):
+        self.assertFalse(self.has_timings(APIClient(SERVER_NAME="localhost")))
+        self.assertFalse(self.has_timings(self.client))
+        staff = create_user(9)
+        staff.is_staff = True
+        staff.save()
+        self.client.force_authenticate(staff)
+        self.assertTrue(self.has_timings(self.client))
+
+
+class ShoppingListPDFTests(SimpleTestCase):
+    def test_lines_are_text_in_the_embedded_font(self):
+        if not os.path.exists(settings.SHOPPING_LIST_FONT):
+            self.skipTest(f"{settings.SHOPPING_LIST_FONT} is not installed")
+        rows = [
+            {
+                "ingredient__name": "Мука",
+                "ingredient__measurement_unit": "г",
+                "total_amount": 500,
+            }
+        ]
+        pdf = b"".join(render_pdf(iter(rows)))
+        self.assertNotIn(b"/Subtype /Image", pdf)
+        self.assertIn(b"/FontFile2", pdf)
+        font = TrueTypeFont.load(settings.SHOPPING_LIST_FONT)
+        glyphs = "".join(
+            f"{font.glyph_id(char):04X}" for char in "Мука (г) - 500"
+        )
+        streams = [
+            zlib.decompress(stream)
+            for stream in re.findall(
+                rb"/FlateDecode >>\nstream\n(.*?)\nendstream", pdf, re.S
+            )
+        ]
+        self.assertIn(f"<{glyphs}> Tj".encode(), b"".join(streams))
@@ -0,0 +1,214 @@
+"""Just enough of a TrueType reader to embed a font subset in a PDF.
+
+The PDF export draws text with glyph ids (``Identity-H`` encoding), so it
+needs the font's character map and advance widths, and a font file cut
+down to the glyphs it used.
+"""
+import struct
+from functools import lru_cache
+
+# Tables a CIDFontType2 font program needs (PDF 1.7, 9.9)
+SUBSET_TABLES = (
+    b"cvt ", b"fpgm", b"glyf", b"head", b"hhea", b"hmtx", b"loca", b"maxp",
+    b"prep",
+)
+# Composite glyph flags
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+
+def _checksum(data):
+    data += b"\0" * (-len(data) % 4)
+    return sum(struct.unpack(f">{len(data) // 4}I", data)) & 0xFFFFFFFF
+
+
+class TrueTypeFont:
+    def __init__(self, data):
+        self.data = data
+        (num_tables,) = struct.unpack_from(">H", data, 4)
+        self.tables = {}
+        for index in range(num_tables):
+            tag, _, offset, length = struct.unpack_from(
+                ">4sIII", data, 12 + 16 * index
+            )
+            self.tables[tag] = data[offset:offset + length]
+        head = self.tables[b"head"]
+        (self.units_per_em,) = struct.unpack_from(">H", head, 18)
+        self.bbox = struct.unpack_from(">4h", head, 36)
+        (self.long_loca,) = struct.unpack_from(">h", head, 50)
+        self.ascent, self.descent = struct.unpack_from(
+            ">hh", self.tables[b"hhea"], 4
+        )
+        (metrics,) = struct.unpack_from(">H", self.tables[b"hhea"], 34)
+        (self.num_glyphs,) = struct.unpack_from(">H", self.tables[b"maxp"], 4)
+        self.advances = [
+            struct.unpack_from(">H", self.tables[b"hmtx"], 4 * index)[0]
+            for index in range(metrics)
+        ]
+        loca = self.tables[b"loca"]
+        if self.long_loca:
+            self.loca = struct.unpack_from(f">{self.num_glyphs + 1}I", loca)
+        else:
+            self.loca = [
+                offset * 2
+                for offset in struct.unpack_from(
+                    f">{self.num_glyphs + 1}H", loca
+                )
+            ]
+        self.cmap = self._read_cmap()
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls(file.read())
+
+    def _read_cmap(self):
+        """Map BMP code points to glyph ids from the format 4 subtable."""
+        cmap = self.tables[b"cmap"]
+        (count,) = struct.unpack_from(">H", cmap, 2)
+        for index in range(count):
+            platform, encoding, offset = struct.unpack_from(
+                ">HHI", cmap, 4 + 8 * index
+            )
+            if (platform, encoding) in ((3, 1), (0, 3)):
+                if struct.unpack_from(">H", cmap, offset)[0] == 4:
+                    return self._read_format4(cmap, offset)
+        raise ValueError("No Unicode BMP character map in the font")
+
+    @staticmethod
+    def _read_format4(cmap, offset):
+        (segments,) = struct.unpack_from(">H", cmap, offset + 6)
+        segments //= 2
+        ends = offset + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        result = {}
+        for segment in range(segments):
+            (end,) = struct.unpack_from(">H", cmap, ends + 2 * segment)
+            (start,) = struct.unpack_from(">H", cmap, starts + 2 * segment)
+            (delta,) = struct.unpack_from(">h", cmap, deltas + 2 * segment)
+            position = range_offsets + 2 * segment
+            (range_offset,) = struct.unpack_from(">H", cmap, position)
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    (glyph,) = struct.unpack_from(
+                        ">H",
+                        cmap,
+                        position + range_offset + 2 * (code - start),
+                    )
+                    if not glyph:
+                        continue
+                else:
+                    glyph = code
+                glyph = (glyph + delta) & 0xFFFF
+                if glyph:
+                    result[code] = glyph
+        return result
+
+    def glyph_id(self, char):
+        """The glyph of ``char``, or 0 (.notdef) when the font lacks it."""
+        return self.cmap.get(ord(char), 0)
+
+    def width(self, glyph):
+        """Advance width of ``glyph`` in thousandths of an em."""
+        advance = self.advances[min(glyph, len(self.advances) - 1)]
+        return round(advance * 1000 / self.units_per_em)
+
+    def scale(self, value):
+        return round(value * 1000 / self.units_per_em)
+
+    def _glyph(self, glyph):
+        start, end = self.loca[glyph], self.loca[glyph + 1]
+        return self.tables[b"glyf"][start:end]
+
+    def _components(self, glyph):
+        """Glyphs a composite glyph is built from."""
+        data = self._glyph(glyph)
+        if len(data) < 10 or struct.unpack_from(">h", data)[0] >= 0:
+            return []
+        components = []
+        position = 10
+        while True:
+            flags, component = struct.unpack_from(">HH", data, position)
+            components.append(component)
+            position += 4
+            position += 4 if flags & ARG_1_AND_2_ARE_WORDS else 2
+            if flags & WE_HAVE_A_SCALE:
+                position += 2
+            elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                position += 4
+            elif flags & WE_HAVE_A_TWO_BY_TWO:
+                position += 8
+            if not flags & MORE_COMPONENTS:
+                return components
+
+    def subset(self, glyphs):
+        """A font file with only ``glyphs`` drawn, ids left unchanged.
+
+        The outlines of other glyphs are dropped, which keeps the glyph
+        ids valid for ``/CIDToGIDMap /Identity``.
+        """
+        keep = {0}
+        pending = list(glyphs)
+        while pending:
+            glyph = pending.pop()
+            if glyph not in keep:
+                keep.add(glyph)
+                pending.extend(self._components(glyph))
+        glyf = bytearray()
+        offsets = []
+        for glyph in range(self.num_glyphs):
+            offsets.append(len(glyf))
+            if glyph in keep:
+                glyf += self._glyph(glyph)
+                glyf += b"\0" * (-len(glyf) % 4)
+        offsets.append(len(glyf))
+        if self.long_loca:
+            loca = struct.pack(f">{len(offsets)}I", *offsets)
+        else:
+            loca = struct.pack(
+                f">{len(offsets)}H", *(offset // 2 for offset in offsets)
+            )
+        head = bytearray(self.tables[b"head"])
+        head[8:12] = b"\0\0\0\0"
+        tables = {
+            tag: self.tables[tag]
+            for tag in SUBSET_TABLES
+            if tag in self.tables
+        }
+        tables.update({b"glyf": bytes(glyf), b"loca": loca, b"head": head})
+        return self._build(tables)
+
+    @staticmethod
+    def _build(tables):
+        count = len(tables)
+        power = 1 << (count.bit_length() - 1)
+        header = struct.pack(
+            ">IHHHH",
+            0x00010000,
+            count,
+            power * 16,
+            power.bit_length() - 1,
+            count * 16 - power * 16,
+        )
+        records = bytearray()
+        body = bytearray()
+        offset = len(header) + 16 * count
+        head_offset = None
+        for tag in sorted(tables):
+            data = bytes(tables[tag])
+            if tag == b"head":
+                head_offset = offset + len(body)
+            records += struct.pack(
+                ">4sIII", tag, _checksum(data), offset + len(body), len(data)
+            )
+            body += data + b"\0" * (-len(data) % 4)
+        font = bytearray(header + records + body)
+        adjustment = (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF
+        struct.pack_into(">I", font, head_offset + 8, adjustment)
+        return bytes(font)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_read
 from .views import IngredientViewSet, RecipeViewSet, UserViewSet
 
 router = DefaultRouter()
@@ -24,3 +26,16 @@ urlpatterns = [
         name="user-subscriptions",
     ),
 ]
+
+if settings.ASYNC_VIEWS:
+    # Ahead of the router, which still serves the other methods.
+    router_views = {
+        pattern.name: pattern.callback for pattern in reversed(router.urls)
+    }
+    urlpatterns = [
+        path("recipes/", async_read(router_views["recipe-list"])),
+        path(
+            "recipes/<int:pk>/", async_read(router_views["recipe-detail"])
+        ),
+        path("ingredients/", async_read(router_views["ingredient-list"])),
+    ] + urlpatterns
@@ -1,5 +1,24 @@
-from django.db.models import Sum
-from django.http import HttpResponse, Http404
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.paginator import InvalidPage, Page
+from django.db import connection, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Value,
+    When,
+    Window,
+)
+from django.db.models.functions import RowNumber
+from django.http import Http404, StreamingHttpResponse
 from django.urls import reverse
 
 from rest_framework import viewsets, permissions, filters
@@ -9,19 +28,23 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 
 from django_filters.rest_framework import DjangoFilterBackend
 
 from recipes.models import (
+    FeedEntry,
     Recipe,
     Ingredient,
     RecipeIngredient,
     Favorite,
-    ShoppingCart
+    ShoppingCart,
 )
+from recipes.feed import schedule_backfill
+from recipes.signals import delete_unused_file
 from users.models import User, Follow
 from .serializers import (
+    BulkIdsSerializer,
     RecipeSerializer,
     IngredientSerializer,
     CustomUserSerializer,
@@ -30,49 +53,459 @@ from .serializers import (
     SetPasswordSerializer,
     SubscriptionSerializer,
     RecipeShortSerializer,
+    RecipeImageSerializer,
+)
+from .filters import RecipeIngredientSetFilter, RecipeSearchFilter
+from .ingredient_index import ingredient_index
+from . import recipe_cache
+from .conditional import (
+    aconditional_response,
+    conditional_response,
+    make_etag,
 )
+from .pagination import KeysetPagination
+from .relations import add_links, remove_links
 from .permissions import IsAuthorOrReadOnly
+from .profiling import ProfilingMixin
+from .renderers import (
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer,
+    TextShoppingListRenderer,
+)
+from .shopping_list import EXPORT_FORMATS, shopping_list_rows
+
+
+def annotate_is_subscribed(queryset, user):
+    """Annotate users with whether ``user`` follows them."""
+    if not user.is_authenticated:
+        return queryset
+    return queryset.annotate(
+        is_subscribed=Exists(
+            Follow.objects.filter(user=user, following=OuterRef("pk"))
+        )
+    )
+
+
+def change_counter(model, pk, field, delta):
+    """Shift a denormalized counter in the database without reading it.
+
+    ``updated_at`` is left alone, so cached representations keyed on it
+    stay valid; the views put counters in their ETags and the recipe
+    cache overlays them on every response.
+    """
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    """Shift the same counter of many rows in one statement."""
+    if delta and pks:
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def follow_authors(user, author_ids):
+    """Follow the authors and return the ids that were not followed yet."""
+    added = add_links(Follow, "user", user.pk, "following", author_ids)
+    change_counters(User, added, "followers_count", 1)
+    FeedEntry.objects.backfill_followed(user.pk, added)
+    return added
+
+
+def unfollow_authors(user, author_ids):
+    """Unfollow the authors and return the ids that were followed."""
+    removed = remove_links(Follow, "user", user.pk, "following", author_ids)
+    change_counters(User, removed, "followers_count", -1)
+    FeedEntry.objects.trim(user.pk, removed)
+    # Authors back at the threshold are fanned out again: restore the rows
+    # skipped while they were above it, after commit and in the background.
+    for author_id in User.objects.filter(
+        pk__in=removed, followers_count=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list("pk", flat=True):
+        schedule_backfill(author_id)
+    return removed
+
+
+def bulk_results(ids, found, changed, done, kept, rejected=None):
+    """Describe what a bulk request did with every requested id.
+
+    ``rejected`` maps ids refused before the write to their status.
+    """
+    rejected = rejected or {}
+    return {
+        "results": [
+            {
+                "id": pk,
+                "status": (
+                    rejected[pk] if pk in rejected
+                    else "not_found" if pk not in found
+                    else done if pk in changed
+                    else kept
+                ),
+            }
+            for pk in ids
+        ]
+    }
+
+
+def attach_recipe_previews(authors, request):
+    """Load the latest recipes of every author in a single query.
+
+    ``?recipes_limit=`` is applied per author with
+    ``ROW_NUMBER() OVER (PARTITION BY author ORDER BY pub_date DESC)``.
+    The recipes are stored on each author as ``recipe_previews``.
+    """
+    recipes = Recipe.objects.filter(author__in=authors).only(
+        "id",
+        "name",
+        "image",
+        "image_with_variants",
+        "cooking_time",
+        "author_id",
+        "pub_date",
+    )
+    try:
+        limit = int(request.query_params.get("recipes_limit", ""))
+    except ValueError:
+        limit = None
+    if limit is not None and limit >= 0:
+        recipes = recipes.annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F("author"),
+                order_by=(F("pub_date").desc(), F("id").desc()),
+            )
+        ).filter(row_number__lte=limit)
+    previews = {author.pk: [] for author in authors}
+    for recipe in recipes.order_by("author", "-pub_date", "-id"):
+        previews[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipe_previews = previews[author.pk]
 
 
 class CustomPagination(PageNumberPagination):
+    """Page number pagination with an opt-in keyset mode.
+
+    ``?pagination=cursor`` (or any ``?cursor=``) switches to keyset
+    pagination over the view's ``keyset_ordering``.
+    """
+
     page_size_query_param = "limit"
     max_page_size = 100
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request, view):
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` on the async ORM."""
+        if self.use_keyset(request, view):
+            return await self.keyset.apaginate_queryset(
+                queryset, request, view
+            )
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Counted here, the cached count is not queried again.
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        bottom = (number - 1) * page_size
+        rows = [row async for row in queryset[bottom:bottom + page_size]]
+        self.page = Page(rows, number, paginator)
+        return rows
+
+    def use_keyset(self, request, view):
+        ordering = getattr(view, "keyset_ordering", None)
+        if ordering and (
+            request.query_params.get("pagination") == "cursor"
+            or KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset = KeysetPagination(
+                ordering, self.get_page_size(request)
+            )
+        return self.keyset is not None
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ConditionalReadMixin:
+    """List and retrieve answering conditional GETs before serializing.
+
+    ETags are computed from ``object_state()`` of the loaded rows plus the
+    pagination envelope, so a 304 costs the page query only.
+
+    ``alist`` and ``aretrieve`` are the same actions for ``api.async_views``:
+    the page and object queries run on the async ORM and serialization in
+    the request's worker thread.
+    """
+
+    def object_state(self, instance):
+        """Return the values whose change changes the representation."""
+        return (instance.pk, instance.updated_at)
 
+    def last_modified(self, instance):
+        """None: counters change without advancing ``updated_at``.
 
-class RecipeViewSet(viewsets.ModelViewSet):
+        Only the ETag, which includes them, validates a cached copy.
+        """
+        return None
+
+    def represent(self, instances):
+        return self.get_serializer(instances, many=True).data
+
+    def list_etag(self, instances, page):
+        envelope = None
+        if page is not None:
+            envelope = self.get_paginated_response([]).data
+        return make_etag(
+            self.request,
+            envelope,
+            [self.object_state(instance) for instance in instances],
+        )
+
+    def list_response(self, instances, page):
+        data = self.represent(instances)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def detail_response(self, instance):
+        data = self.represent([instance])
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+    def conditional_list(self, queryset):
+        page = self.paginate_queryset(queryset)
+        instances = list(queryset) if page is None else page
+        # No Last-Modified: removing a row from a list does not advance it.
+        return conditional_response(
+            self.request,
+            partial(self.list_response, instances, page),
+            self.list_etag(instances, page),
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_list(self.filter_queryset(self.get_queryset()))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return conditional_response(
+            request,
+            partial(self.detail_response, instance),
+            make_etag(request, self.object_state(instance)),
+            self.last_modified(instance),
+        )
+
+    async def afilter_queryset(self, queryset):
+        # django-filter validates model choices such as ?author= by
+        # loading them.
+        fields = getattr(self, "filterset_fields", ())
+        if any(field in self.request.query_params for field in fields):
+            return await sync_to_async(self.filter_queryset)(queryset)
+        return self.filter_queryset(queryset)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = None
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(
+                queryset, request, self
+            )
+        if page is None:
+            instances = [instance async for instance in queryset]
+        else:
+            instances = page
+        return await aconditional_response(
+            request,
+            partial(self.list_response, instances, page),
+            self.list_etag(instances, page),
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            # The message of get_object_or_404(), which get_object() uses
+            raise Http404(
+                "No %s matches the given query."
+                % queryset.model._meta.object_name
+            )
+        self.check_object_permissions(request, instance)
+        return await aconditional_response(
+            request,
+            partial(self.detail_response, instance),
+            make_etag(request, self.object_state(instance)),
+            self.last_modified(instance),
+        )
+
+
+class RecipeViewSet(
+    ProfilingMixin, ConditionalReadMixin, viewsets.ModelViewSet
+):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
         IsAuthorOrReadOnly
     ]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [
+        DjangoFilterBackend,
+        RecipeSearchFilter,
+        RecipeIngredientSetFilter,
+        filters.OrderingFilter,
+    ]
     filterset_fields = ["author"]
     search_fields = ["name"]
+    ordering_fields = ["pub_date", "favorites_count", "in_carts_count"]
     pagination_class = CustomPagination
+    keyset_ordering = ("-pub_date", "-id")
+
+    read_actions = ("list", "retrieve", "feed")
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = self.annotate_flags(super().get_queryset())
         user = self.request.user
 
-        is_favorited = self.request.query_params.get("is_favorited")
-        if is_favorited == "1" and user.is_authenticated:
-            queryset = queryset.filter(favorites__user=user)
-        elif is_favorited == "0" and user.is_authenticated:
-            queryset = queryset.exclude(favorites__user=user)
+        if user.is_authenticated:
+            is_favorited = self.request.query_params.get("is_favorited")
+            if is_favorited == "1":
+                queryset = queryset.filter(is_favorited=True)
+            elif is_favorited == "0":
+                queryset = queryset.filter(is_favorited=False)
 
-        is_in_shopping_cart = self.request.query_params.get(
-            "is_in_shopping_cart"
-        )
-        if is_in_shopping_cart == "1" and user.is_authenticated:
-            queryset = queryset.filter(shopping_carts__user=user)
-        elif is_in_shopping_cart == "0" and user.is_authenticated:
-            queryset = queryset.exclude(shopping_carts__user=user)
+            is_in_shopping_cart = self.request.query_params.get(
+                "is_in_shopping_cart"
+            )
+            if is_in_shopping_cart == "1":
+                queryset = queryset.filter(is_in_shopping_cart=True)
+            elif is_in_shopping_cart == "0":
+                queryset = queryset.filter(is_in_shopping_cart=False)
 
+        if self.action in self.read_actions:
+            queryset = self.select_for_cache(queryset)
         return queryset
 
+    def annotate_flags(self, queryset):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+        )
+
+    def select_for_cache(self, queryset):
+        """Load only the fields the recipe cache needs for a page.
+
+        These are the cache key parts and the per-user values overlaid on
+        the cached representations.
+        """
+        queryset = queryset.select_related("author").only(
+            "id",
+            "author",
+            "pub_date",
+            "updated_at",
+            "favorites_count",
+            "in_carts_count",
+            "author__updated_at",
+            "author__recipes_count",
+            "author__followers_count",
+        )
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            author_is_subscribed=Exists(
+                Follow.objects.filter(user=user, following=OuterRef("author"))
+            )
+        )
+
+    def serialize_recipes(self, pks):
+        queryset = self.optimize_for_read(
+            self.annotate_flags(Recipe.objects.filter(pk__in=pks))
+        )
+        return self.get_serializer(queryset, many=True).data
+
+    def object_state(self, recipe):
+        author = recipe.author
+        return (
+            recipe.pk,
+            recipe.updated_at,
+            author.updated_at,
+            recipe.favorites_count,
+            recipe.in_carts_count,
+            author.recipes_count,
+            author.followers_count,
+            getattr(recipe, "is_favorited", None),
+            getattr(recipe, "is_in_shopping_cart", None),
+            getattr(recipe, "author_is_subscribed", None),
+        )
+
+    def represent(self, recipes):
+        data, hits, misses = recipe_cache.representations(
+            recipes, self.request, self.serialize_recipes
+        )
+        self.recipe_cache_stats = f"hits={hits}, misses={misses}"
+        return data
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        stats = getattr(self, "recipe_cache_stats", None)
+        if stats is not None:
+            response["X-Recipe-Cache"] = stats
+        return response
+
+    def optimize_for_read(self, queryset):
+        """Load authors and ingredients in a constant number of queries."""
+        return queryset.defer("search_vector").prefetch_related(
+            Prefetch(
+                "author",
+                queryset=annotate_is_subscribed(
+                    User.objects.all(), self.request.user
+                ),
+            ),
+            Prefetch(
+                "recipeingredient_set",
+                queryset=RecipeIngredient.objects.select_related(
+                    "ingredient"
+                ),
+            ),
+        )
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        change_counter(User, self.request.user.pk, "recipes_count", 1)
+        FeedEntry.objects.fan_out(recipe)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        change_counter(User, instance.author_id, "recipes_count", -1)
 
     @action(
         detail=True,
@@ -89,6 +522,28 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
         return Response({"short-link": short_link}, status=status.HTTP_200_OK)
 
+    @action(
+        detail=True,
+        methods=["put"],
+        permission_classes=[permissions.IsAuthenticated, IsAuthorOrReadOnly],
+        parser_classes=[MultiPartParser, FormParser],
+    )
+    def image(self, request, pk=None):
+        """Replace the recipe image with a multipart file upload."""
+        recipe = self.get_object()
+        if "image" not in request.data:
+            return Response(
+                {"image": ["Это поле обязательно."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = RecipeImageSerializer(
+            recipe, data=request.data, context={"request": request}
+        )
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     @action(
         detail=True,
         methods=["post", "delete"],
@@ -104,22 +559,30 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
 
         if request.method == "POST":
-            if request.user.favorites.filter(recipe=recipe).exists():
+            with transaction.atomic():
+                added = add_links(
+                    Favorite, "user", request.user.pk, "recipe", [recipe.pk]
+                )
+                if added:
+                    change_counter(Recipe, recipe.pk, "favorites_count", 1)
+            if not added:
                 return Response(
                     {"errors": "Рецепт уже в избранном."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            Favorite.objects.create(user=request.user, recipe=recipe)
             serializer = RecipeShortSerializer(
                 recipe,
                 context={"request": request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:  # DELETE method
-            deleted_count, _ = request.user.favorites.filter(
-                recipe=recipe
-            ).delete()
-            if deleted_count == 0:
+            with transaction.atomic():
+                removed = remove_links(
+                    Favorite, "user", request.user.pk, "recipe", [recipe.pk]
+                )
+                if removed:
+                    change_counter(Recipe, recipe.pk, "favorites_count", -1)
+            if not removed:
                 return Response(
                     {"errors": "Рецепта не было в избранном."},
                     status=status.HTTP_400_BAD_REQUEST,
@@ -142,55 +605,125 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
 
         if request.method == "POST":
-            if request.user.shopping_carts.filter(recipe=recipe).exists():
+            with transaction.atomic():
+                added = add_links(
+                    ShoppingCart,
+                    "user",
+                    request.user.pk,
+                    "recipe",
+                    [recipe.pk],
+                )
+                if added:
+                    change_counter(Recipe, recipe.pk, "in_carts_count", 1)
+            if not added:
                 return Response(
                     {"errors": "Рецепт уже в корзине."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
             serializer = RecipeShortSerializer(
                 recipe,
                 context={"request": request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:  # DELETE method
-            deleted_count, _ = request.user.shopping_carts.filter(
-                recipe=recipe
-            ).delete()
-            if deleted_count == 0:
+            with transaction.atomic():
+                removed = remove_links(
+                    ShoppingCart,
+                    "user",
+                    request.user.pk,
+                    "recipe",
+                    [recipe.pk],
+                )
+                if removed:
+                    change_counter(Recipe, recipe.pk, "in_carts_count", -1)
+            if not removed:
                 return Response(
                     {"errors": "Рецепт не был в корзине."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def change_many(self, request, model, counter):
+        """Add or remove many recipes of a per-user relation at once.
+
+        Ids are checked in one query, rows are inserted or removed with
+        one statement reporting what changed and the counters of all
+        affected recipes are shifted in one ``UPDATE``.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        found = set(
+            Recipe.objects.filter(pk__in=ids).values_list("pk", flat=True)
+        )
+        with transaction.atomic():
+            if request.method == "POST":
+                changed = add_links(
+                    model, "user", request.user.pk, "recipe", found
+                )
+                delta, done, kept = 1, "added", "exists"
+            else:
+                changed = remove_links(
+                    model, "user", request.user.pk, "recipe", found
+                )
+                delta, done, kept = -1, "removed", "absent"
+            change_counters(Recipe, changed, counter, delta)
+        return Response(bulk_results(ids, found, changed, done, kept))
+
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        url_path="favorite",
+        url_name="bulk-favorite",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def bulk_favorite(self, request):
+        """Add or remove the recipes listed in ``ids`` from favorites."""
+        return self.change_many(request, Favorite, "favorites_count")
+
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        url_path="shopping_cart",
+        url_name="bulk-shopping-cart",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def bulk_shopping_cart(self, request):
+        """Add or remove the recipes listed in ``ids`` from the cart."""
+        return self.change_many(request, ShoppingCart, "in_carts_count")
+
     @action(
         detail=False,
         methods=["get"],
         permission_classes=[permissions.IsAuthenticated],
     )
-    def download_shopping_cart(self, request):
-        ingredients = (
-            RecipeIngredient.objects.filter(
-                recipe__shopping_carts__user=request.user
-            )
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(total_amount=Sum("amount"))
+    def feed(self, request):
+        """Recipes of followed authors, newest first."""
+        return self.conditional_list(
+            self.get_queryset().feed(request.user).order_by("-pub_date", "-id")
         )
 
-        content = "\n".join(
-            [
-                f"{item['ingredient__name']} "
-                f"({item['ingredient__measurement_unit']}) - "
-                f"{item['total_amount']}"
-                for item in ingredients
-            ]
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[
+            TextShoppingListRenderer,
+            CSVShoppingListRenderer,
+            PDFShoppingListRenderer,
+        ],
+    )
+    def download_shopping_cart(self, request):
+        """Stream the shopping list as txt (default), csv or pdf."""
+        export_format = request.accepted_renderer.format
+        render, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            render(shopping_list_rows(request.user)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping_list.{export_format}"'
         )
-
-        response = HttpResponse(content, content_type="text/plain")
-        response[
-            "Content-Disposition"
-        ] = 'attachment; filename="shopping_list.txt"'
         return response
 
     def update(self, request, *args, **kwargs):
@@ -219,12 +752,88 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(name__istartswith=name)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """Answer ``?name=`` prefix queries from the in-memory index.
+
+        ``?fuzzy=1`` switches to typo-tolerant search ranked by trigram
+        similarity, with prefix matches first.
+        """
+        return self.conditional_search(ingredient_index.get_snapshot())
+
+    async def alist(self, request, *args, **kwargs):
+        """``list`` for ``api.async_views``.
+
+        Prefix queries never leave the event loop; fuzzy and ``?search=``
+        queries go to the database from the request's worker thread.
+        """
+        snapshot = await ingredient_index.aget_snapshot()
+        if self.queries_database():
+            return await sync_to_async(self.conditional_search)(snapshot)
+        return self.conditional_search(snapshot)
+
+    def queries_database(self):
+        params = self.request.query_params
+        return params.get("fuzzy") == "1" or bool(
+            params.get(filters.SearchFilter.search_param)
+        )
+
+    def conditional_search(self, snapshot):
+        request = self.request
+        name = request.query_params.get("name", "")
+
+        def build():
+            if request.query_params.get("fuzzy") == "1" and name:
+                return Response(self.fuzzy_search(name, snapshot))
+            if request.query_params.get(filters.SearchFilter.search_param):
+                return super(IngredientViewSet, self).list(request)
+            return Response(ingredient_index.search(name, snapshot))
+
+        # The catalogue is shared and may be as stale as the index anyway.
+        return conditional_response(
+            request,
+            build,
+            make_etag(request, snapshot.digest, per_user=False),
+            per_user=False,
+            max_age=settings.INGREDIENT_INDEX_TTL,
+        )
+
+    def fuzzy_search(self, query, snapshot):
+        limit = settings.INGREDIENT_FUZZY_LIMIT
+        if connection.vendor != "postgresql":
+            return ingredient_index.fuzzy_search(query, limit, snapshot)
+        # Both conditions are served by the pg_trgm GIN index on name.
+        queryset = (
+            Ingredient.objects.filter(
+                Q(name__istartswith=query)
+                | Q(name__trigram_word_similar=query)
+            )
+            .annotate(
+                is_prefix=Case(
+                    When(name__istartswith=query, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                ),
+                similarity=TrigramWordSimilarity(query, "name"),
+            )
+            .order_by("-is_prefix", "-similarity", "name")
+            .values("id", "name", "measurement_unit")[:limit]
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SET LOCAL pg_trgm.word_similarity_threshold = %s",
+                [settings.INGREDIENT_FUZZY_THRESHOLD],
+            )
+            return list(queryset)
+
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(
+    ProfilingMixin, ConditionalReadMixin, viewsets.ModelViewSet
+):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     pagination_class = CustomPagination
+    keyset_ordering = ("username", "id")
 
     def get_permissions(self):
         if self.action == "create":
@@ -250,41 +859,94 @@ class UserViewSet(viewsets.ModelViewSet):
                     {"errors": "Нельзя подписаться на самого себя."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            if request.user.followers.filter(following=user).exists():
+            with transaction.atomic():
+                added = follow_authors(request.user, [user.pk])
+            if not added:
                 return Response(
                     {"errors": "Вы уже подписаны на этого пользователя."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            Follow.objects.create(user=request.user, following=user)
             serializer = SubscriptionSerializer(
                 user,
                 context={"request": request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:  # DELETE method
-            if not request.user.followers.filter(following=user).exists():
+            with transaction.atomic():
+                removed = unfollow_authors(request.user, [user.pk])
+            if not removed:
                 return Response(
                     {"errors": "Подписка не найдена."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            request.user.followers.filter(following=user).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        url_path="subscribe",
+        url_name="bulk-subscribe",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def bulk_subscribe(self, request):
+        """Follow or unfollow the users listed in ``ids``.
+
+        The user's own id gets the ``self`` status, as one cannot follow
+        oneself.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        found = set(
+            User.objects.filter(pk__in=ids)
+            .exclude(pk=request.user.pk)
+            .values_list("pk", flat=True)
+        )
+        with transaction.atomic():
+            if request.method == "POST":
+                changed = follow_authors(request.user, found)
+                done, kept = "added", "exists"
+            else:
+                changed = unfollow_authors(request.user, found)
+                done, kept = "removed", "absent"
+        return Response(
+            bulk_results(
+                ids, found, changed, done, kept,
+                rejected={request.user.pk: "self"},
+            )
+        )
+
     def get_queryset(self):
         queryset = super().get_queryset()
         limit = self.request.query_params.get("limit")
         if limit:
             self.paginator.page_size = int(limit)
+        if self.action in ("list", "retrieve"):
+            queryset = annotate_is_subscribed(queryset, self.request.user)
         return queryset
 
+    def object_state(self, user):
+        return (
+            user.pk,
+            user.updated_at,
+            user.recipes_count,
+            user.followers_count,
+            getattr(user, "is_subscribed", None),
+        )
+
     @action(
         detail=False,
         methods=["get"],
         permission_classes=[IsAuthenticated]
     )
     def me(self, request):
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        user = request.user
+        return conditional_response(
+            request,
+            lambda: Response(self.get_serializer(user).data),
+            make_etag(request, self.object_state(user)),
+            self.last_modified(user),
+        )
 
     @action(
         detail=False,
@@ -301,7 +963,9 @@ class UserViewSet(viewsets.ModelViewSet):
                 {"avatar": ["Это поле обязательно."]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        serializer = AvatarSerializer(user, data=request.data)
+        serializer = AvatarSerializer(
+            user, data=request.data, context={"request": request}
+        )
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -314,11 +978,16 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
     )
     def delete_avatar(self, request):
-        """Delete user's avatar."""
+        """Delete user's avatar.
+
+        The file may be shared with other users who uploaded the same
+        bytes, so it is only removed once no one uses it.
+        """
         user = request.user
-        user.avatar.delete()
+        name = user.avatar.name
         user.avatar = None
         user.save()
+        transaction.on_commit(lambda: delete_unused_file(name))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -346,14 +1015,17 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscriptions(self, request):
         """Retrieve list of user's subscriptions."""
-        following_users = User.objects.filter(followers__user=request.user)
+        following_users = User.objects.filter(following__user=request.user)
         page = self.paginate_queryset(following_users)
         if page is not None:
+            attach_recipe_previews(page, request)
             serializer = SubscriptionSerializer(
                 page, many=True, context={"request": request}
             )
             return self.get_paginated_response(serializer.data)
 
+        following_users = list(following_users)
+        attach_recipe_previews(following_users, request)
         serializer = SubscriptionSerializer(
             following_users, many=True, context={"request": request}
         )
@@ -6,6 +6,12 @@ while ! nc -z db 5432; do
 done
 echo "PostgreSQL started"
 
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  # Metric files of a previous run would be summed with the new ones
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 python manage.py migrate
 
 python manage.py collectstatic --no-input
@@ -16,4 +22,10 @@ python manage.py load_data || echo "Failed to load ingredients"
 echo "Creating superuser if not exists..."
 python manage.py shell -c "from django.contrib.auth import get_user_model; User = get_user_model(); User.objects.filter(username='admin').exists() or User.objects.create_superuser('admin', 'admin@example.com', 'admin')"
 
+if [ "$ASYNC_VIEWS" = "True" ]; then
+  # Async views need an event loop: one uvicorn worker serves many requests
+  exec gunicorn foodgram.asgi:application \
+    --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000
+fi
+
 exec gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
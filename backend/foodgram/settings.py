@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import ipaddress
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -22,7 +23,7 @@ SECRET_KEY = "django-insecure-m8rnp$)498$1^)!_yg7lrr-9#pdtd(-7tu+mz+ps)t*ya9npij
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG", "False") == "True"
 
-ALLOWED_HOSTS = ["localhost", "127.0.0.1"]
+ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
 
 # Application definition
 INSTALLED_APPS = [
@@ -32,6 +33,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "djoser",
@@ -51,6 +53,10 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 6,  # Исправлено с '6d' на 6
     "PAGE_SIZE_QUERY_PARAM": "limit",
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 DJOSER = {
@@ -72,6 +78,7 @@ DJOSER = {
 }
 
 MIDDLEWARE = [
+    "api.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -110,6 +117,7 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", default="password"),
         "HOST": os.getenv("DB_HOST", default="db"),
         "PORT": os.getenv("DB_PORT", default=5432),
+        "TEST": {"NAME": os.getenv("DB_TEST_NAME")},
     }
 }
 
@@ -144,5 +152,115 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Largest image (in bytes) returned as a data URI with ?inline_images=1
+INLINE_IMAGE_MAX_SIZE = int(os.getenv("INLINE_IMAGE_MAX_SIZE", 256 * 1024))
+
+# Upload limits checked before an image is fully decoded
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv("MAX_IMAGE_UPLOAD_SIZE", 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 25_000_000))
+
+# Resized WebP/JPEG variants of recipe images and avatars
+# (0 workers renders them synchronously after commit)
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", 2))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 82))
+
+# Seconds before the in-process ingredient prefix index is rebuilt
+INGREDIENT_INDEX_TTL = int(os.getenv("INGREDIENT_INDEX_TTL", 300))
+
+# ?fuzzy=1 ingredient search: result count and the minimal trigram word
+# similarity of a match (pg_trgm.word_similarity_threshold on PostgreSQL)
+INGREDIENT_FUZZY_LIMIT = int(os.getenv("INGREDIENT_FUZZY_LIMIT", 20))
+INGREDIENT_FUZZY_THRESHOLD = float(
+    os.getenv("INGREDIENT_FUZZY_THRESHOLD", 0.5)
+)
+
+# TrueType font with Cyrillic glyphs for shopping list PDF exports
+SHOPPING_LIST_FONT = os.getenv(
+    "SHOPPING_LIST_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+# Authors with more followers are not fanned out to follower timelines;
+# their recipes are merged into /api/recipes/feed/ at read time
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv("FEED_FANOUT_MAX_FOLLOWERS", 1000))
+# Timelines restored when an author drops back to that threshold
+# (0 workers backfills synchronously after commit)
+FEED_BACKFILL_WORKERS = int(os.getenv("FEED_BACKFILL_WORKERS", 1))
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Seconds a serialized recipe stays cached (entries are also replaced as
+# soon as the recipe or its author changes)
+RECIPE_CACHE_TIMEOUT = int(os.getenv("RECIPE_CACHE_TIMEOUT", 3600))
+
+# Seconds shared caches may reuse anonymous API responses before
+# revalidating them with ETag / Last-Modified
+API_PUBLIC_MAX_AGE = int(os.getenv("API_PUBLIC_MAX_AGE", 60))
+
+# Most ids accepted by one bulk favorite / cart / subscribe request
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", 100))
+
+# Per-request Server-Timing headers and JSON log lines; a request running
+# the same SQL statement more than the threshold times is logged as N+1
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "True") == "True"
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv("INSTRUMENTATION_N_PLUS_ONE_THRESHOLD", 10)
+)
+# Server-Timing goes to staff users only, unless DEBUG or this is on
+INSTRUMENTATION_PUBLIC_TIMINGS = (
+    os.getenv("INSTRUMENTATION_PUBLIC_TIMINGS", "False") == "True"
+)
+
+# /metrics answers clients from these networks (nginx does not proxy it)
+# or sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_NETWORKS = [
+    ipaddress.ip_network(network)
+    for network in os.getenv(
+        "METRICS_NETWORKS",
+        "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16",
+    ).split(",")
+]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Serve GET of the recipe list and detail, the ingredient search and short
+# links with async views; set together with running foodgram.asgi under
+# uvicorn workers (entrypoint.sh does both). Keep CONN_MAX_AGE at 0 then:
+# each async request queries from its own thread and connection
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False") == "True"
+
+# Opt-in profiling of RecipeViewSet / UserViewSet requests: a share of the
+# requests to the listed views ("RecipeViewSet" or "RecipeViewSet.list"),
+# plus staff requests sending an X-Profile header. "sample" writes
+# collapsed stacks, "cprofile" pstats files; see manage.py profile_report
+PROFILING_VIEWS = frozenset(
+    name for name in os.getenv("PROFILING_VIEWS", "").split(",") if name
+)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.01))
+PROFILING_MODE = os.getenv("PROFILING_MODE", "sample")
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", 0.001))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 500))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.instrumentation": {
+            "handlers": ["console"],
+            "level": os.getenv("INSTRUMENTATION_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
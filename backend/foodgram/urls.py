@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponseRedirect
+from api.metrics import metrics_view
 from recipes.models import Recipe
 
 
@@ -10,8 +12,19 @@ def redirect_short_link(request, recipe_id):
     return HttpResponseRedirect("/api/recipes/")
 
 
+async def aredirect_short_link(request, recipe_id):
+    if await Recipe.objects.filter(id=recipe_id).aexists():
+        return HttpResponseRedirect(f"/api/recipes/{recipe_id}/")
+    return HttpResponseRedirect("/api/recipes/")
+
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
-    path("r/<int:recipe_id>/", redirect_short_link, name="recipe-short-link"),
+    path(
+        "r/<int:recipe_id>/",
+        aredirect_short_link if settings.ASYNC_VIEWS else redirect_short_link,
+        name="recipe-short-link",
+    ),
+    path("metrics", metrics_view, name="metrics"),
 ]
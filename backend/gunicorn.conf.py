@@ -0,0 +1,12 @@
+# Loaded by gunicorn from the working directory.
+import os
+
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+
+
+def child_exit(server, worker):
+    """Drop the metrics of an exited worker from the shared directory."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,25 +1,22 @@
 from django.contrib import admin
 
 from .models import (
+    FeedEntry,
     Favorite,
     Ingredient,
     Recipe,
     RecipeIngredient,
-    ShoppingCart
+    ShoppingCart,
+    ShoppingListItem,
 )
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ("name", "author", "favorite_count")
+    list_display = ("name", "author", "favorites_count")
     search_fields = ("name", "author__username")
     list_select_related = ("author",)
 
-    def favorite_count(self, obj):
-        return obj.favorite_set.count()
-
-    favorite_count.short_description = "Добавлено в избранное"
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -43,3 +40,15 @@ class FavoriteAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ("user", "recipe")
     list_select_related = ("user", "recipe")
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ("user", "ingredient", "total_amount")
+    list_select_related = ("user", "ingredient")
+
+
+@admin.register(FeedEntry)
+class FeedEntryAdmin(admin.ModelAdmin):
+    list_display = ("user", "recipe")
+    list_select_related = ("user", "recipe")
@@ -0,0 +1,48 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """A lazily started thread pool for work done off the request path.
+
+    The number of threads is read from the ``setting`` named at creation;
+    with 0 the work runs inline, which is what tests use.
+    """
+
+    def __init__(self, setting, thread_name_prefix, description):
+        self.setting = setting
+        self.thread_name_prefix = thread_name_prefix
+        self.description = description
+        self._executor = None
+
+    def submit(self, function, *args):
+        workers = getattr(settings, self.setting)
+        if workers == 0:
+            function(*args)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix=self.thread_name_prefix,
+            )
+        future = self._executor.submit(self._run, function, *args)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _run(function, *args):
+        # Pool threads outlive requests, so they close their own connections.
+        close_old_connections()
+        try:
+            function(*args)
+        finally:
+            close_old_connections()
+
+    def _log_failure(self, future):
+        error = future.exception()
+        if error is not None:
+            logger.error("%s failed: %s", self.description, error)
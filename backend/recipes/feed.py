@@ -0,0 +1,34 @@
+from django.db import transaction
+
+from .background import BackgroundPool
+from .models import FEED_BATCH_SIZE, FeedEntry, User
+
+_pool = BackgroundPool(
+    "FEED_BACKFILL_WORKERS", "feed-backfill", "Feed backfill"
+)
+
+
+def backfill_author(author_id):
+    """Write the author's recipes to follower timelines, batch by batch.
+
+    Each batch covers ``FEED_BATCH_SIZE`` followers. The author is checked
+    before every batch: once above ``FEED_FANOUT_MAX_FOLLOWERS`` again,
+    their recipes are merged in at read time and the rest is skipped.
+    """
+    followers = (
+        User.objects.filter(follower__following=author_id)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    last = 0
+    while FeedEntry.objects.fans_out(author_id):
+        batch = list(followers.filter(pk__gt=last)[:FEED_BATCH_SIZE])
+        if not batch:
+            return
+        FeedEntry.objects.backfill(author_id, batch)
+        last = batch[-1]
+
+
+def schedule_backfill(author_id):
+    """Backfill the author's followers after commit, off the request path."""
+    transaction.on_commit(lambda: _pool.submit(backfill_author, author_id))
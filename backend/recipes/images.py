@@ -0,0 +1,118 @@
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .background import BackgroundPool
+
+logger = logging.getLogger(__name__)
+
+# name: (width, height, crop to exact size)
+VARIANTS = {
+    "card": (480, 360, True),
+    "detail": (1200, 900, False),
+    "avatar-small": (96, 96, True),
+}
+RECIPE_VARIANTS = ("card", "detail")
+AVATAR_VARIANTS = ("avatar-small",)
+FORMATS = (("webp", "WEBP"), ("jpeg", "JPEG"))
+
+_pool = BackgroundPool(
+    "IMAGE_VARIANT_WORKERS", "image-variants", "Image variant generation"
+)
+
+# Sent with ``name`` and ``variants`` once the variants are stored; the
+# receivers record it on the rows using the image
+variants_ready = Signal()
+
+
+def variant_name(name, variant, ext):
+    """Return the storage name of a variant stored next to the original."""
+    root, _ = os.path.splitext(name)
+    return f"{root}.{variant}.{ext}"
+
+
+def variant_stored(name, variant):
+    # The JPEG is written last, so its presence means the variant is done.
+    return default_storage.exists(variant_name(name, variant, FORMATS[-1][0]))
+
+
+def variant_urls(name, variants, ready):
+    """Return variant URLs, or the original's while ``ready`` is false.
+
+    Storage is not touched: whether the variants of an image are stored
+    is recorded on the model when ``variants_ready`` is sent.
+    """
+    original = default_storage.url(name)
+    return {
+        variant: {
+            ext: (
+                default_storage.url(variant_name(name, variant, ext))
+                if ready
+                else original
+            )
+            for ext, _ in FORMATS
+        }
+        for variant in variants
+    }
+
+
+def delete_variants(name, variants):
+    """Delete the stored variants of an image that is no longer used."""
+    for variant in variants:
+        for ext, _ in FORMATS:
+            default_storage.delete(variant_name(name, variant, ext))
+
+
+def generate_variants(name, variants):
+    """Render every size and format of ``variants`` for image ``name``."""
+    try:
+        with default_storage.open(name, "rb") as original:
+            image = ImageOps.exif_transpose(Image.open(original))
+            image.load()
+    except (OSError, ValueError):
+        logger.warning("Cannot open image %s for resizing", name)
+        return
+    for variant in variants:
+        width, height, crop = VARIANTS[variant]
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        if resized.mode not in ("RGB", "RGBA"):
+            resized = resized.convert("RGBA")
+        for ext, pil_format in FORMATS:
+            target = variant_name(name, variant, ext)
+            frame = resized
+            if pil_format == "JPEG" and frame.mode == "RGBA":
+                frame = Image.new("RGB", frame.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel("A"))
+            buffer = BytesIO()
+            frame.save(buffer, pil_format, quality=settings.IMAGE_QUALITY)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    variants_ready.send(sender=None, name=name, variants=variants)
+
+
+def schedule_variants(name, variants):
+    """Generate missing variants in the worker pool, off the request path.
+
+    Nothing is queued for a name with no stored file behind it.
+    """
+    if not default_storage.exists(name):
+        return
+    missing = [
+        variant for variant in variants if not variant_stored(name, variant)
+    ]
+    if not missing:
+        # Stored for another row using the same file.
+        variants_ready.send(sender=None, name=name, variants=variants)
+        return
+    _pool.submit(generate_variants, name, missing)
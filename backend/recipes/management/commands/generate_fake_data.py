@@ -0,0 +1,421 @@
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from io import BytesIO
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+import shortuuid
+
+from recipes.images import RECIPE_VARIANTS, generate_variants
+from recipes.models import (
+    SHORT_LINK_LENGTH,
+    Favorite,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from users.models import Follow
+
+User = get_user_model()
+
+DEFAULT_PASSWORD = "fake-password"
+# Typical recipes list 5-10 ingredients, a few list more than twenty
+INGREDIENTS_MEDIAN = 7
+INGREDIENTS_SIGMA = 0.45
+MAX_INGREDIENTS = 30
+MAX_GENERATED_AMOUNT = 500
+FIRST_NAMES = (
+    "Анна", "Иван", "Мария", "Пётр", "Ольга", "Алексей", "Елена",
+    "Дмитрий", "Наталья", "Сергей", "Татьяна", "Михаил",
+)
+LAST_NAMES = (
+    "Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров",
+    "Соколов", "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков",
+)
+DISHES = (
+    "Суп", "Салат", "Пирог", "Рагу", "Омлет", "Плов", "Запеканка",
+    "Паста", "Каша", "Котлеты", "Блины", "Жаркое", "Гуляш", "Кекс",
+)
+STYLES = (
+    "домашний", "по-деревенски", "с травами", "острый", "быстрый",
+    "праздничный", "летний", "постный", "по-бабушкиному", "сытный",
+)
+STEPS = (
+    "Нарежьте ингредиенты.",
+    "Разогрейте сковороду с маслом.",
+    "Доведите до кипения и убавьте огонь.",
+    "Посолите и поперчите по вкусу.",
+    "Запекайте до золотистой корочки.",
+    "Перемешайте и дайте настояться.",
+    "Подавайте горячим.",
+    "Украсьте зеленью.",
+)
+IMAGE_COLORS = (
+    (214, 69, 65), (242, 156, 56), (247, 202, 24), (46, 204, 113),
+    (52, 152, 219), (155, 89, 182), (149, 165, 166), (211, 84, 0),
+)
+
+
+class Zipf:
+    """Sample indexes ``0..size - 1`` with Zipf-distributed popularity.
+
+    Ranks are shuffled, so popular items are spread over the index range
+    instead of being the first ones created.
+    """
+
+    def __init__(self, rng, size, exponent):
+        self.rng = rng
+        self.items = rng.sample(range(size), size)
+        self.cum_weights = list(
+            accumulate(1 / rank**exponent for rank in range(1, size + 1))
+        )
+
+    def sample(self, count):
+        return self.rng.choices(
+            self.items, cum_weights=self.cum_weights, k=count
+        )
+
+    def distinct(self, count, exclude=None):
+        """Return up to ``count`` distinct items, skipping ``exclude``."""
+        chosen = set(self.sample(count))
+        chosen.discard(exclude)
+        return chosen
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует пользователей, рецепты, избранное, корзины и подписки "
+        "для нагрузочного тестирования"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users", type=int, default=1000, help="Число пользователей"
+        )
+        parser.add_argument(
+            "--recipes", type=int, default=5000, help="Число рецептов"
+        )
+        parser.add_argument(
+            "--favorites",
+            type=float,
+            default=20,
+            help="Среднее число рецептов в избранном у пользователя",
+        )
+        parser.add_argument(
+            "--carts",
+            type=float,
+            default=3,
+            help="Среднее число рецептов в корзине у пользователя",
+        )
+        parser.add_argument(
+            "--follows",
+            type=float,
+            default=10,
+            help="Среднее число подписок у пользователя",
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.1,
+            help="Показатель распределения популярности рецептов и авторов",
+        )
+        parser.add_argument(
+            "--images",
+            type=int,
+            default=8,
+            help="Сколько общих картинок раздать рецептам (0 - без картинок)",
+        )
+        parser.add_argument(
+            "--password",
+            default=DEFAULT_PASSWORD,
+            help="Пароль всех созданных пользователей",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Зерно генератора для повторяемости"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк записывать за один запрос",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1:
+            raise CommandError("Нужен хотя бы один пользователь")
+        ingredient_ids = list(
+            Ingredient.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError(
+                "В базе нет ингредиентов, сначала выполните load_data"
+            )
+        self.rng = random.Random(options["seed"])
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        self.started = time.monotonic()
+        plan = self.plan(options, len(ingredient_ids))
+        images = self.create_images(options["images"])
+        with transaction.atomic():
+            user_ids = self.create_users(plan, options["password"])
+            recipe_ids = self.create_recipes(plan, user_ids, images)
+            self.create_links(plan, user_ids, recipe_ids, ingredient_ids)
+            self.build_derived(plan, user_ids, recipe_ids, ingredient_ids)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Создано пользователей: {len(user_ids)}, "
+                f"рецептов: {len(recipe_ids)}, "
+                f"в избранном: {len(plan['favorites'])}, "
+                f"в корзинах: {len(plan['carts'])}, "
+                f"подписок: {len(plan['follows'])} "
+                f"за {time.monotonic() - self.started:.2f} с"
+            )
+        )
+
+    def plan(self, options, ingredient_count):
+        """Draw every row as indexes first, so counters are known upfront."""
+        rng = self.rng
+        users, recipes = options["users"], options["recipes"]
+        exponent = options["zipf"]
+        # Prolific authors are also the most followed ones.
+        authors = Zipf(rng, users, exponent)
+        popular_recipes = Zipf(rng, recipes, exponent) if recipes else None
+        staples = Zipf(rng, ingredient_count, exponent)
+        plan = {
+            "users": users,
+            "authors": authors.sample(recipes),
+            "ingredients": [
+                {
+                    ingredient: rng.randint(1, MAX_GENERATED_AMOUNT)
+                    for ingredient in sorted(
+                        staples.distinct(self.ingredient_count())
+                    )
+                }
+                for _ in range(recipes)
+            ],
+            "favorites": [],
+            "carts": [],
+            "follows": [],
+        }
+        for user in range(users):
+            if popular_recipes is not None:
+                for name, mean in (("favorites", options["favorites"]),
+                                   ("carts", options["carts"])):
+                    plan[name].extend(
+                        (user, recipe)
+                        for recipe in popular_recipes.distinct(
+                            self.activity(mean)
+                        )
+                    )
+            plan["follows"].extend(
+                (user, author)
+                for author in authors.distinct(
+                    self.activity(options["follows"]), exclude=user
+                )
+            )
+        plan["recipes_count"] = Counter(plan["authors"])
+        plan["followers_count"] = Counter(
+            author for _, author in plan["follows"]
+        )
+        plan["favorites_count"] = Counter(
+            recipe for _, recipe in plan["favorites"]
+        )
+        plan["in_carts_count"] = Counter(
+            recipe for _, recipe in plan["carts"]
+        )
+        self.report("План построен")
+        return plan
+
+    def ingredient_count(self):
+        count = self.rng.lognormvariate(
+            math.log(INGREDIENTS_MEDIAN), INGREDIENTS_SIGMA
+        )
+        return max(1, min(MAX_INGREDIENTS, round(count)))
+
+    def activity(self, mean):
+        """Heavy-tailed number of links of one user."""
+        if mean <= 0:
+            return 0
+        return round(self.rng.expovariate(1 / mean))
+
+    def create_images(self, count):
+        """Store a few placeholder images shared by the recipes."""
+        names = []
+        for index in range(count):
+            color = IMAGE_COLORS[index % len(IMAGE_COLORS)]
+            buffer = BytesIO()
+            Image.new("RGB", (640, 480), color).save(buffer, "JPEG")
+            name = default_storage.save(
+                f"recipes/fake-{index}.jpg", ContentFile(buffer.getvalue())
+            )
+            generate_variants(name, RECIPE_VARIANTS)
+            names.append(name)
+        if names:
+            self.report(f"Картинок сохранено: {len(names)}")
+        return names
+
+    def create_users(self, plan, password):
+        # One hash for everyone: hashing each password would take minutes.
+        password = make_password(password)
+        tag = uuid.uuid4().hex[:6]
+        users = (
+            User(
+                username=f"fake_{tag}_{index}",
+                email=f"fake_{tag}_{index}@example.com",
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+                recipes_count=plan["recipes_count"][index],
+                followers_count=plan["followers_count"][index],
+            )
+            for index in range(plan["users"])
+        )
+        user_ids = [
+            user.pk
+            for user in User.objects.bulk_create(
+                list(users), batch_size=self.batch_size
+            )
+        ]
+        self.report(f"Пользователей создано: {len(user_ids)}")
+        return user_ids
+
+    def create_recipes(self, plan, user_ids, images):
+        recipes = [
+            Recipe(
+                author_id=user_ids[author],
+                name=(
+                    f"{self.rng.choice(DISHES)} {self.rng.choice(STYLES)}"
+                ),
+                text=" ".join(
+                    self.rng.sample(STEPS, self.rng.randint(2, len(STEPS)))
+                ),
+                image=self.rng.choice(images) if images else None,
+                cooking_time=self.rng.randint(5, 180),
+                # bulk_create() does not call save(), which fills it in.
+                short_link=shortuuid.uuid()[:SHORT_LINK_LENGTH],
+                favorites_count=plan["favorites_count"][index],
+                in_carts_count=plan["in_carts_count"][index],
+            )
+            for index, author in enumerate(plan["authors"])
+        ]
+        recipe_ids = [
+            recipe.pk
+            for recipe in Recipe.objects.bulk_create(
+                recipes, batch_size=self.batch_size
+            )
+        ]
+        self.report(f"Рецептов создано: {len(recipe_ids)}")
+        return recipe_ids
+
+    def create_links(self, plan, user_ids, recipe_ids, ingredient_ids):
+        self.insert(
+            RecipeIngredient,
+            (
+                RecipeIngredient(
+                    recipe_id=recipe_ids[recipe],
+                    ingredient_id=ingredient_ids[ingredient],
+                    amount=amount,
+                )
+                for recipe, ingredients in enumerate(plan["ingredients"])
+                for ingredient, amount in ingredients.items()
+            ),
+        )
+        for model, pairs in ((Favorite, plan["favorites"]),
+                             (ShoppingCart, plan["carts"])):
+            self.insert(
+                model,
+                (
+                    model(user_id=user_ids[user], recipe_id=recipe_ids[recipe])
+                    for user, recipe in pairs
+                ),
+            )
+        self.insert(
+            Follow,
+            (
+                Follow(user_id=user_ids[user], following_id=user_ids[author])
+                for user, author in plan["follows"]
+            ),
+        )
+
+    def insert(self, model, objects):
+        created = model.objects.bulk_create(
+            list(objects), batch_size=self.batch_size
+        )
+        self.report(f"{model._meta.verbose_name_plural}: {len(created)}")
+
+    def build_derived(self, plan, user_ids, recipe_ids, ingredient_ids):
+        """Fill the tables the API keeps in step with the raw rows."""
+        for start in range(0, len(recipe_ids), self.batch_size):
+            recipes = Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + self.batch_size]
+            )
+            recipes.update_search_vector()
+            recipes.update_ingredient_ids()
+        totals = Counter()
+        for user, recipe in plan["carts"]:
+            for ingredient, amount in plan["ingredients"][recipe].items():
+                totals[user, ingredient] += amount
+        self.insert(
+            ShoppingListItem,
+            (
+                ShoppingListItem(
+                    user_id=user_ids[user],
+                    ingredient_id=ingredient_ids[ingredient],
+                    total_amount=total_amount,
+                )
+                for (user, ingredient), total_amount in totals.items()
+            ),
+        )
+        self.fill_feeds(user_ids)
+
+    def fill_feeds(self, user_ids):
+        """Fan out the recipes of the new authors to their followers.
+
+        One ``INSERT ... SELECT``: timelines hold followers times recipes
+        rows, far too many to build as model instances. Authors above
+        ``FEED_FANOUT_MAX_FOLLOWERS`` are skipped as by the API.
+        """
+        quote = connection.ops.quote_name
+        feed = quote(FeedEntry._meta.db_table)
+        follow = quote(Follow._meta.db_table)
+        recipe = quote(Recipe._meta.db_table)
+        user = quote(User._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {feed} (user_id, recipe_id)
+                SELECT follow.user_id, recipe.id
+                FROM {follow} AS follow
+                JOIN {user} AS author ON author.id = follow.following_id
+                JOIN {recipe} AS recipe ON recipe.author_id = author.id
+                WHERE author.id BETWEEN %s AND %s
+                AND author.followers_count <= %s
+                ON CONFLICT DO NOTHING
+                """,
+                [
+                    min(user_ids),
+                    max(user_ids),
+                    settings.FEED_FANOUT_MAX_FOLLOWERS,
+                ],
+            )
+            added = cursor.rowcount
+        self.report(f"{FeedEntry._meta.verbose_name_plural}: {added}")
+
+    def report(self, message):
+        if self.verbosity < 1:
+            return
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f"{message} ({elapsed:.2f} с)")
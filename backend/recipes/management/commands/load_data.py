@@ -1,60 +1,217 @@
+import csv
 import json
 import os
-from django.core.management.base import BaseCommand
+import time
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
 from recipes.models import Ingredient
+from recipes.signals import ingredients_changed
+
+DEFAULT_PATH = "/app/data/ingredients.json"
+DATA_DIRS = ("./data", "../data", "/app/data")
+FORMATS = ("json", "csv")
+READ_SIZE = 64 * 1024
+NAME_LENGTH = Ingredient._meta.get_field("name").max_length
+UNIT_LENGTH = Ingredient._meta.get_field("measurement_unit").max_length
+
+
+def iter_json(file):
+    """Yield the items of a top-level JSON array, reading it in chunks."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("ожидается массив объектов")
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof and not buffer:
+                raise ValueError("массив не закрыт")
+            if eof:
+                raise
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_csv(file):
+    """Yield ``name,measurement_unit`` rows, with or without a header."""
+    for row in csv.reader(file):
+        if not row or row[:2] == ["name", "measurement_unit"]:
+            continue
+        yield {
+            "name": row[0],
+            "measurement_unit": row[1] if len(row) > 1 else "",
+        }
+
+
+READERS = {"json": iter_json, "csv": iter_csv}
 
 
 class Command(BaseCommand):
-    help = "Загружает ингредиенты из JSON файла"
+    help = (
+        "Загружает ингредиенты из JSON или CSV файла: добавляет новые и "
+        "обновляет изменившиеся единицы измерения"
+    )
 
     def add_arguments(self, parser):
+        parser.add_argument("file_path", nargs="?", default=DEFAULT_PATH)
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Формат файла (по умолчанию по расширению)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк сравнивать и записывать за один запрос",
+        )
         parser.add_argument(
-            "file_path", nargs="?", type=str, default="/app/data/ingredients.json"
+            "--dry-run",
+            action="store_true",
+            help="Только показать изменения, ничего не записывая",
         )
 
     def handle(self, *args, **options):
-        file_path = options["file_path"]
-
-        if not os.path.exists(file_path):
-            self.stdout.write(self.style.ERROR(f"Файл {file_path} не существует"))
-            alternate_paths = [
-                "./data/ingredients.json",
-                "../data/ingredients.json",
-                "/app/data/ingredients.json",
-            ]
-            for path in alternate_paths:
-                if os.path.exists(path):
-                    file_path = path
-                    self.stdout.write(self.style.SUCCESS(f"Найден файл по пути {path}"))
-                    break
-            else:
-                self.stdout.write(self.style.ERROR("Файл с ингредиентами не найден"))
-                return
-
+        file_path = self.find_file(options["file_path"])
+        file_format = options["format"] or os.path.splitext(file_path)[1][1:]
+        if file_format not in FORMATS:
+            raise CommandError(
+                f"Не удалось определить формат {file_path}, укажите --format"
+            )
+        dry_run = options["dry_run"]
+        self.verbosity = options["verbosity"]
+        stats = Counter()
+        changed_ids = []
+        started = time.monotonic()
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
+            with open(file_path, encoding="utf-8", newline="") as file:
+                rows = self.clean(READERS[file_format](file), stats)
+                while True:
+                    batch = dict(islice(rows, options["batch_size"]))
+                    if not batch:
+                        break
+                    changed_ids += self.import_batch(batch, dry_run, stats)
+                    self.report_progress(stats, started)
+        except (ValueError, csv.Error) as error:
+            raise CommandError(f"Неверный формат {file_path}: {error}")
+        if changed_ids:
+            ingredients_changed.send(
+                sender=Ingredient, ingredient_ids=changed_ids
+            )
+        elapsed = time.monotonic() - started
+        summary = (
+            f"Создано: {stats['created']}, обновлено: {stats['updated']}, "
+            f"без изменений: {stats['unchanged']}, "
+            f"пропущено: {stats['skipped']}, "
+            f"повторов: {stats['duplicates']} за {elapsed:.2f} с "
+            f"({self.rate(stats, elapsed):.0f} строк/с)"
+        )
+        if dry_run:
+            summary = f"Пробный запуск, база не изменена. {summary}"
+        self.stdout.write(self.style.SUCCESS(summary))
 
-            if Ingredient.objects.exists():
-                self.stdout.write(
-                    self.style.WARNING("Ингредиенты уже существуют в базе данных.")
-                )
-                return
+    def find_file(self, file_path):
+        if os.path.exists(file_path):
+            return file_path
+        name = os.path.basename(file_path)
+        for directory in DATA_DIRS:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                self.stdout.write(f"Найден файл по пути {path}")
+                return path
+        raise CommandError(f"Файл {file_path} не найден")
 
-            ingredient_count = 0
-            for item in data:
-                Ingredient.objects.get_or_create(
-                    name=item["name"], measurement_unit=item["measurement_unit"]
-                )
-                ingredient_count += 1
+    def clean(self, items, stats):
+        """Yield valid ``(name, measurement_unit)`` pairs.
 
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Успешно импортировано {ingredient_count} ингредиентов"
+        Only the first row of each name is imported; repeats are reported
+        and counted, since a batch keeps one unit per name.
+        """
+        units = {}
+        for item in items:
+            try:
+                name = str(item["name"]).strip()
+                unit = str(item["measurement_unit"]).strip()
+            except (KeyError, TypeError):
+                stats["skipped"] += 1
+                continue
+            if (
+                not name
+                or not unit
+                or len(name) > NAME_LENGTH
+                or len(unit) > UNIT_LENGTH
+            ):
+                stats["skipped"] += 1
+                continue
+            if name in units:
+                stats["duplicates"] += 1
+                self.stderr.write(
+                    f"Повтор ингредиента {name} ({unit}), "
+                    f"оставлен первый ({units[name]})"
                 )
+                continue
+            units[name] = unit
+            yield name, unit
+
+    def import_batch(self, batch, dry_run, stats):
+        """Upsert the new and changed rows of ``batch``.
+
+        Returns the ids of existing ingredients whose unit changed.
+        """
+        existing = {
+            name: (pk, unit)
+            for pk, name, unit in Ingredient.objects.filter(
+                name__in=batch
+            ).values_list("pk", "name", "measurement_unit")
+        }
+        changed = []
+        changed_ids = []
+        for name, unit in batch.items():
+            pk, old_unit = existing.get(name, (None, None))
+            if pk is None:
+                stats["created"] += 1
+                if dry_run:
+                    self.stdout.write(f"+ {name} ({unit})")
+            elif old_unit != unit:
+                stats["updated"] += 1
+                changed_ids.append(pk)
+                if dry_run:
+                    self.stdout.write(f"~ {name}: {old_unit} -> {unit}")
+            else:
+                stats["unchanged"] += 1
+                continue
+            changed.append(Ingredient(name=name, measurement_unit=unit))
+        if changed and not dry_run:
+            Ingredient.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=["name"],
+                update_fields=["measurement_unit"],
             )
+        return [] if dry_run else changed_ids
 
-        except json.JSONDecodeError:
-            self.stdout.write(self.style.ERROR(f"Неверный формат JSON в {file_path}"))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Ошибка во время импорта: {str(e)}"))
+    def report_progress(self, stats, started):
+        if self.verbosity < 1:
+            return
+        elapsed = time.monotonic() - started
+        processed = sum(stats.values())
+        self.stdout.write(
+            f"Обработано {processed} строк "
+            f"({self.rate(stats, elapsed):.0f} строк/с)"
+        )
+
+    def rate(self, stats, elapsed):
+        return sum(stats.values()) / elapsed if elapsed else 0
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = "Пересобирает или проверяет таблицу списков покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только сравнить таблицу с корзинами, ничего не меняя",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Сколько пользователей обрабатывать за один запрос",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            ShoppingCart.objects.values_list("user", flat=True)
+            .distinct()
+            .order_by("user")
+        )
+        if options["verify"]:
+            self.verify(user_ids, options["chunk_size"])
+            return
+        stale, _ = ShoppingListItem.objects.exclude(user__in=user_ids).delete()
+        chunk_size = options["chunk_size"]
+        for start in range(0, len(user_ids), chunk_size):
+            ShoppingListItem.objects.refresh(
+                user_ids[start:start + chunk_size]
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Списки покупок пересобраны для {len(user_ids)} "
+                f"пользователей, удалено лишних позиций: {stale}"
+            )
+        )
+
+    def verify(self, user_ids, chunk_size):
+        mismatches = ShoppingListItem.objects.exclude(
+            user__in=user_ids
+        ).count()
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            live = {
+                (row["recipe__shopping_carts__user"], row["ingredient"]):
+                    row["total_amount"]
+                for row in RecipeIngredient.objects.filter(
+                    recipe__shopping_carts__user__in=chunk
+                )
+                .values("recipe__shopping_carts__user", "ingredient")
+                .annotate(total_amount=Sum("amount"))
+                .order_by()
+            }
+            stored = {
+                (user_id, ingredient_id): total_amount
+                for user_id, ingredient_id, total_amount in (
+                    ShoppingListItem.objects.filter(
+                        user__in=chunk
+                    ).values_list("user", "ingredient", "total_amount")
+                )
+            }
+            mismatches += sum(
+                1
+                for key in live.keys() | stored.keys()
+                if live.get(key) != stored.get(key)
+            )
+        if mismatches:
+            raise CommandError(
+                f"Найдено расхождений в списках покупок: {mismatches}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS("Списки покупок совпадают с корзинами")
+        )
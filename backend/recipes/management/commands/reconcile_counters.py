@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow
+
+User = get_user_model()
+
+# (model, counter field, related model, field pointing back to the model)
+COUNTERS = (
+    (Recipe, "favorites_count", Favorite, "recipe"),
+    (Recipe, "in_carts_count", ShoppingCart, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "followers_count", Follow, "following"),
+)
+
+
+class Command(BaseCommand):
+    help = "Сверяет денормализованные счётчики с данными и чинит расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Сколько строк проверять за один запрос",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать расхождения, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        for model, field, related, link in COUNTERS:
+            repaired = self.reconcile(
+                model,
+                field,
+                related,
+                link,
+                options["chunk_size"],
+                options["dry_run"],
+            )
+            self.stdout.write(
+                f"{model.__name__}.{field}: расхождений {repaired}"
+            )
+        self.stdout.write(self.style.SUCCESS("Сверка счётчиков завершена"))
+
+    def reconcile(self, model, field, related, link, chunk_size, dry_run):
+        live = (
+            related.objects.filter(**{link: OuterRef("pk")})
+            .values(link)
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        repaired = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(
+                    model.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .select_for_update()
+                    .annotate(live=Coalesce(Subquery(live), 0))
+                    .only("pk", field)[:chunk_size]
+                )
+                if not chunk:
+                    return repaired
+                last_pk = chunk[-1].pk
+                drifted = [
+                    obj for obj in chunk if getattr(obj, field) != obj.live
+                ]
+                repaired += len(drifted)
+                if drifted and not dry_run:
+                    now = timezone.now()
+                    for obj in drifted:
+                        setattr(obj, field, obj.live)
+                        obj.updated_at = now
+                    model.objects.bulk_update(drifted, [field, "updated_at"])
@@ -0,0 +1,53 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+INDEX_NAME = "recipes_recipe_search_vector_gin"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_recipe "
+        "USING gin (search_vector)"
+    )
+    schema_editor.execute(
+        """
+        UPDATE recipes_recipe AS recipe SET search_vector =
+            setweight(to_tsvector('russian', coalesce(recipe.name, '')), 'A')
+            || setweight(
+                to_tsvector('russian', coalesce(recipe.text, '')), 'B'
+            )
+            || setweight(to_tsvector('russian', coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM recipes_recipeingredient AS item
+                JOIN recipes_ingredient AS ingredient
+                    ON ingredient.id = item.ingredient_id
+                WHERE item.recipe_id = recipe.id
+            ), '')), 'C')
+        """
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0005_ingredient_name_trigram_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+INDEX_NAME = "recipes_recipe_ingredient_ids_gin"
+
+
+def add_ingredient_ids(apps, schema_editor):
+    # The column is PostgreSQL-only and stays out of the model state, so
+    # inserts on other databases never have to bind a bigint[] value.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE recipes_recipe "
+        "ADD COLUMN IF NOT EXISTS ingredient_ids bigint[]"
+    )
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_recipe "
+        "USING gin (ingredient_ids)"
+    )
+    schema_editor.execute(
+        """
+        UPDATE recipes_recipe AS recipe SET ingredient_ids = coalesce((
+            SELECT array_agg(item.ingredient_id ORDER BY item.ingredient_id)
+            FROM recipes_recipeingredient AS item
+            WHERE item.recipe_id = recipe.id
+        ), '{}')
+        """
+    )
+
+
+def drop_ingredient_ids(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+    schema_editor.execute(
+        "ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS ingredient_ids"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0006_recipe_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_ingredient_ids, drop_ingredient_ids),
+    ]
@@ -0,0 +1,46 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+# Copied from recipes.images, so later changes there leave this alone
+RECIPE_VARIANTS = ("card", "detail")
+
+
+def variant_stored(name, variant):
+    # The JPEG of a variant is written last, so it marks a finished one.
+    root, _ = os.path.splitext(name)
+    return default_storage.exists(f"{root}.{variant}.jpeg")
+
+
+def record_stored_variants(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    names = Recipe.objects.exclude(image="").values_list(
+        "image", flat=True
+    ).distinct()
+    for name in names.iterator():
+        if all(variant_stored(name, variant) for variant in RECIPE_VARIANTS):
+            Recipe.objects.filter(image=name).update(image_with_variants=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0011_recipe_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_with_variants",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=100,
+                verbose_name="Изображение с готовыми вариантами",
+            ),
+        ),
+        migrations.RunPython(
+            record_stored_variants, migrations.RunPython.noop
+        ),
+    ]
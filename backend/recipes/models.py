@@ -1,5 +1,13 @@
-from django.db import models
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 import shortuuid
 
 User = get_user_model()
@@ -10,6 +18,12 @@ MAX_AMOUNT = 32000
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32000
 SHORT_LINK_LENGTH = 22
+SEARCH_CONFIG = "russian"
+FEED_BATCH_SIZE = 1000
+
+# Users and ingredients of the shopping list refreshes put off by
+# ShoppingListItemManager.deferred_refresh()
+_deferred_refresh = ContextVar("deferred_shopping_list_refresh", default=None)
 
 
 class Ingredient(models.Model):
@@ -33,6 +47,76 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def update_search_vector(self):
+        """Store the full-text vector of the recipes (PostgreSQL only).
+
+        The name is weighted over the description, which is weighted over
+        the ingredient names.
+        """
+        if connection.vendor != "postgresql":
+            return 0
+        ingredient_names = (
+            RecipeIngredient.objects.filter(recipe=models.OuterRef("pk"))
+            .values("recipe")
+            .annotate(names=StringAgg("ingredient__name", delimiter=" "))
+            .values("names")
+        )
+        return self.update(
+            search_vector=(
+                SearchVector("name", weight="A", config=SEARCH_CONFIG)
+                + SearchVector("text", weight="B", config=SEARCH_CONFIG)
+                + SearchVector(
+                    models.Subquery(ingredient_names),
+                    weight="C",
+                    config=SEARCH_CONFIG,
+                )
+            )
+        )
+
+    def update_ingredient_ids(self):
+        """Store the sorted ingredient ids of the recipes (PostgreSQL only).
+
+        ``ingredient_ids`` is a GIN-indexed ``bigint[]`` column added by a
+        PostgreSQL-only migration and kept out of the model fields. It backs
+        the ingredient set filters.
+        """
+        if connection.vendor != "postgresql":
+            return 0
+        pks, params = self.order_by().values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE recipes_recipe AS recipe SET ingredient_ids = coalesce((
+                    SELECT array_agg(
+                        item.ingredient_id ORDER BY item.ingredient_id
+                    )
+                    FROM recipes_recipeingredient AS item
+                    WHERE item.recipe_id = recipe.id
+                ), '{{}}')
+                WHERE recipe.id IN ({pks})
+                """,
+                params,
+            )
+            return cursor.rowcount
+
+    def feed(self, user):
+        """Recipes of the authors ``user`` follows.
+
+        Recipes of authors with few followers come from the user's
+        timeline rows; authors above ``FEED_FANOUT_MAX_FOLLOWERS`` are not
+        fanned out and are merged in by author at read time.
+        """
+        popular_authors = User.objects.filter(
+            following__user=user,
+            followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        )
+        return self.filter(
+            models.Q(pk__in=user.feed_entries.values("recipe"))
+            | models.Q(author__in=popular_authors)
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -50,6 +134,12 @@ class Recipe(models.Model):
         blank=True,
         verbose_name="Изображение",
     )
+    image_with_variants = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name="Изображение с готовыми вариантами",
+    )
     text = models.TextField(verbose_name="Описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -59,11 +149,11 @@ class Recipe(models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name="Время приготовления (мин)",
         validators=[
-            models.MinValueValidator(
+            MinValueValidator(
                 MIN_COOKING_TIME,
                 message="Время приготовления должно быть не менее 1 минуты."
             ),
-            models.MaxValueValidator(
+            MaxValueValidator(
                 MAX_COOKING_TIME,
                 message="Время приготовления не может превышать 32,000 минут."
             ),
@@ -73,16 +163,42 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name="Дата публикации",
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата изменения",
+    )
     short_link = models.CharField(
         max_length=SHORT_LINK_LENGTH,
         unique=True,
         blank=True,
         verbose_name="Короткая ссылка",
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Добавлено в избранное",
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Добавлено в корзины",
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name="Поисковый вектор",
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
-        indexes = [models.Index(fields=["pub_date"])]
+        indexes = [
+            models.Index(fields=["pub_date"]),
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_id_idx"
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -109,10 +225,10 @@ class RecipeIngredient(models.Model):
     amount = models.PositiveSmallIntegerField(
         verbose_name="Количество",
         validators=[
-            models.MinValueValidator(
+            MinValueValidator(
                 MIN_AMOUNT, message="Количество должно быть не менее 1."
             ),
-            models.MaxValueValidator(
+            MaxValueValidator(
                 MAX_AMOUNT, message="Количество не может превышать 32,000."
             ),
         ],
@@ -181,3 +297,228 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f"{self.user.username} добавил {self.recipe.name} в корзину"
+
+
+class ShoppingListItemManager(models.Manager):
+    def refresh(self, user_ids, ingredient_ids=None):
+        """Recompute shopping list items from the cart tables.
+
+        Only the items of ``user_ids`` (and of ``ingredient_ids`` when
+        given) are touched, so a cart change costs one aggregate over the
+        affected rows instead of a rebuild of the whole list. The signals
+        of ``recipes.signals`` call it on every cart or recipe change.
+        """
+        deferred = _deferred_refresh.get()
+        if deferred is not None:
+            deferred["users"].update(user_ids)
+            if ingredient_ids is None:
+                deferred["all_ingredients"] = True
+            else:
+                deferred["ingredients"].update(ingredient_ids)
+            return
+        totals = RecipeIngredient.objects.filter(
+            recipe__shopping_carts__user__in=user_ids
+        )
+        scope = self.filter(user__in=user_ids)
+        if ingredient_ids is not None:
+            totals = totals.filter(ingredient__in=ingredient_ids)
+            scope = scope.filter(ingredient__in=ingredient_ids)
+        with transaction.atomic():
+            # Refreshes of the same user wait for each other until commit,
+            # so each aggregate sees the cart rows of the one before it.
+            list(
+                User.objects.select_for_update()
+                .filter(pk__in=user_ids)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            items = [
+                self.model(
+                    user_id=row["recipe__shopping_carts__user"],
+                    ingredient_id=row["ingredient"],
+                    total_amount=row["total_amount"],
+                )
+                for row in totals.values(
+                    "recipe__shopping_carts__user", "ingredient"
+                )
+                .annotate(total_amount=models.Sum("amount"))
+                .order_by()
+            ]
+            self.bulk_create(
+                items,
+                update_conflicts=True,
+                unique_fields=["user", "ingredient"],
+                update_fields=["total_amount"],
+            )
+            scope.exclude(
+                models.Exists(
+                    RecipeIngredient.objects.filter(
+                        recipe__shopping_carts__user=models.OuterRef("user"),
+                        ingredient=models.OuterRef("ingredient"),
+                    )
+                )
+            ).delete()
+
+    @contextmanager
+    def deferred_refresh(self):
+        """Merge the refreshes requested inside the block into one.
+
+        For writes that change many rows one by one, such as replacing the
+        ingredients of a recipe. Nothing is refreshed if the block raises.
+        """
+        if _deferred_refresh.get() is not None:
+            yield
+            return
+        deferred = {
+            "users": set(),
+            "ingredients": set(),
+            "all_ingredients": False,
+        }
+        token = _deferred_refresh.set(deferred)
+        try:
+            yield
+        finally:
+            _deferred_refresh.reset(token)
+        if deferred["users"]:
+            self.refresh(
+                deferred["users"],
+                None if deferred["all_ingredients"]
+                else deferred["ingredients"],
+            )
+
+
+class ShoppingListItem(models.Model):
+    """Ingredient totals of a user's shopping cart, kept up to date."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name="Ингредиент",
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name="Общее количество",
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item",
+            )
+        ]
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Список покупок"
+
+    def __str__(self):
+        return f"{self.ingredient} для {self.user}: {self.total_amount}"
+
+
+class FeedEntryManager(models.Manager):
+    def fans_out(self, author_id):
+        """Whether the author's recipes are written to follower timelines."""
+        return User.objects.filter(
+            pk=author_id,
+            followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).exists()
+
+    def fan_out(self, recipe):
+        """Add a new recipe to the timelines of its author's followers."""
+        if not self.fans_out(recipe.author_id):
+            return
+        followers = User.objects.filter(
+            follower__following=recipe.author_id
+        ).values_list("pk", flat=True)
+        self.insert(
+            self.model(user_id=user_id, recipe_id=recipe.pk)
+            for user_id in followers.iterator(chunk_size=FEED_BATCH_SIZE)
+        )
+
+    def backfill(self, author_id, user_ids=None):
+        """Add the author's recipes to the timelines of ``user_ids``.
+
+        Without ``user_ids`` every follower of the author is backfilled.
+        """
+        if user_ids is None:
+            user_ids = User.objects.filter(
+                follower__following=author_id
+            ).values_list("pk", flat=True)
+        recipe_ids = list(
+            Recipe.objects.filter(author=author_id).values_list(
+                "pk", flat=True
+            )
+        )
+        self.insert(
+            self.model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in recipe_ids
+        )
+
+    def backfill_followed(self, user_id, author_ids):
+        """Add recipes of newly followed authors to the user's timeline.
+
+        Authors above the fan-out threshold are skipped, as their recipes
+        are merged in at read time.
+        """
+        recipe_ids = Recipe.objects.filter(
+            author__in=author_ids,
+            author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).values_list("pk", flat=True)
+        self.insert(
+            self.model(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in recipe_ids.iterator(chunk_size=FEED_BATCH_SIZE)
+        )
+
+    def trim(self, user_id, author_ids):
+        """Remove the authors' recipes from the user's timeline."""
+        return self.filter(
+            user=user_id, recipe__author__in=author_ids
+        ).delete()
+
+    def insert(self, entries):
+        """Insert timeline rows in batches, skipping existing ones."""
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, FEED_BATCH_SIZE))
+            if not batch:
+                return
+            self.bulk_create(batch, ignore_conflicts=True)
+
+
+class FeedEntry(models.Model):
+    """A recipe in the timeline of a follower of its author."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Пользователь",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Рецепт",
+    )
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_feed_entry",
+            )
+        ]
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Ленты подписок"
+
+    def __str__(self):
+        return f"{self.recipe} в ленте {self.user}"
@@ -0,0 +1,289 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.functions import Now
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import Signal, receiver
+
+from .images import (
+    AVATAR_VARIANTS,
+    RECIPE_VARIANTS,
+    delete_variants,
+    schedule_variants,
+    variants_ready,
+)
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+
+User = get_user_model()
+
+# Sent with ``ingredient_ids`` after a bulk update of existing ingredients,
+# which bypasses post_save
+ingredients_changed = Signal()
+# Sent with ``recipe_ids`` after recipe ingredients are bulk created
+recipe_ingredients_changed = Signal()
+# Sent by api.relations with ``owner_id`` and ``target_ids`` after the
+# links it inserts or deletes with raw SQL
+links_changed = Signal()
+
+
+def _previous_image(instance, field_name, update_fields):
+    """Name of the image a save of ``instance`` may replace."""
+    if instance._state.adding or (
+        update_fields is not None and field_name not in update_fields
+    ):
+        return None
+    return (
+        type(instance)
+        .objects.filter(pk=instance.pk)
+        .values_list(field_name, flat=True)
+        .first()
+    )
+
+
+def _image_saved(instance, field_name, variants, update_fields):
+    if update_fields is not None and field_name not in update_fields:
+        return
+    name = getattr(instance, field_name).name
+    previous = getattr(instance, f"previous_{field_name}", None)
+    if previous and previous != name:
+        transaction.on_commit(
+            lambda: _delete_unused_variants(previous, variants)
+        )
+    if (
+        name
+        and name != instance._meta.get_field(field_name).get_default()
+        and getattr(instance, f"{field_name}_with_variants") != name
+    ):
+        transaction.on_commit(lambda: schedule_variants(name, variants))
+
+
+def _image_deleted(name, variants):
+    if name:
+        transaction.on_commit(lambda: _delete_unused_variants(name, variants))
+
+
+def _in_use(name):
+    # Content-hash names let several rows share one file.
+    return (
+        Recipe.objects.filter(image=name).exists()
+        or User.objects.filter(avatar=name).exists()
+    )
+
+
+def _delete_unused_variants(name, variants):
+    if not _in_use(name):
+        delete_variants(name, variants)
+
+
+def delete_unused_file(name):
+    """Delete the stored image ``name`` unless a recipe or user uses it."""
+    if name and not _in_use(name):
+        default_storage.delete(name)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_previous_image(sender, instance, update_fields=None, **kwargs):
+    instance.previous_image = _previous_image(
+        instance, "image", update_fields
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_variants(sender, instance, update_fields=None, **kwargs):
+    _image_saved(instance, "image", RECIPE_VARIANTS, update_fields)
+
+
+@receiver(post_delete, sender=Recipe)
+def deleted_recipe_image_variants(sender, instance, **kwargs):
+    _image_deleted(instance.image.name, RECIPE_VARIANTS)
+
+
+@receiver(variants_ready)
+def record_variants(sender, name, **kwargs):
+    # Rows already marked are left alone: many users share the default
+    # avatar.
+    Recipe.objects.filter(image=name).exclude(
+        image_with_variants=name
+    ).update(image_with_variants=name, updated_at=Now())
+    User.objects.filter(avatar=name).exclude(
+        avatar_with_variants=name
+    ).update(avatar_with_variants=name, updated_at=Now())
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_indexes(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {"name", "text"} & set(
+        update_fields
+    ):
+        return
+    # After commit, so that ingredients written with the recipe are indexed.
+    _update_indexes_on_commit(Recipe.objects.filter(pk=instance.pk))
+
+
+def _deleted_directly(origin, model):
+    """Whether a delete started from ``model`` rather than a cascade."""
+    if isinstance(origin, QuerySet):
+        return issubclass(origin.model, model)
+    return origin is None or isinstance(origin, model)
+
+
+def _update_indexes_on_commit(recipes):
+    def update_indexes():
+        recipes.update_search_vector()
+        recipes.update_ingredient_ids()
+
+    transaction.on_commit(update_indexes)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_indexes(sender, instance, origin=None, **kwargs):
+    # Deleted recipes leave nothing to index, and an ingredient deletion
+    # updates all of its recipes at once below.
+    if not _deleted_directly(origin, RecipeIngredient):
+        return
+    _update_indexes_on_commit(Recipe.objects.filter(pk=instance.recipe_id))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_recipes(sender, instance, **kwargs):
+    # Its recipe rows are gone by post_delete.
+    instance.recipe_ids = list(
+        Recipe.objects.filter(ingredients=instance).values_list(
+            "pk", flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def deleted_ingredient_indexes(sender, instance, **kwargs):
+    recipe_ids = getattr(instance, "recipe_ids", None)
+    if recipe_ids:
+        _update_indexes_on_commit(Recipe.objects.filter(pk__in=recipe_ids))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_search_vector(sender, instance, created=False, **kwargs):
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update_search_vector()
+
+
+@receiver(pre_save, sender=User)
+def previous_avatar(sender, instance, update_fields=None, **kwargs):
+    instance.previous_avatar = _previous_image(
+        instance, "avatar", update_fields
+    )
+
+
+@receiver(post_save, sender=User)
+def avatar_variants(sender, instance, update_fields=None, **kwargs):
+    _image_saved(instance, "avatar", AVATAR_VARIANTS, update_fields)
+
+
+@receiver(post_delete, sender=User)
+def deleted_avatar_variants(sender, instance, **kwargs):
+    _image_deleted(instance.avatar.name, AVATAR_VARIANTS)
+
+
+def _cart_users(recipe_ids):
+    return list(
+        ShoppingCart.objects.filter(recipe__in=recipe_ids)
+        .values_list("user", flat=True)
+        .distinct()
+    )
+
+
+def _recipe_ingredients(recipe_ids):
+    return list(
+        RecipeIngredient.objects.filter(recipe__in=recipe_ids)
+        .values_list("ingredient", flat=True)
+        .distinct()
+    )
+
+
+def _refresh_cart(cart):
+    ShoppingListItem.objects.refresh(
+        [cart.user_id], _recipe_ingredients([cart.recipe_id])
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def saved_cart_shopping_list(sender, instance, **kwargs):
+    _refresh_cart(instance)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def deleted_cart_shopping_list(sender, instance, origin=None, **kwargs):
+    # A deleted user's list goes with it, deleted recipes are handled below.
+    if _deleted_directly(origin, ShoppingCart):
+        _refresh_cart(instance)
+
+
+@receiver(links_changed, sender=ShoppingCart)
+def cart_links_shopping_list(sender, owner_id, target_ids, **kwargs):
+    ShoppingListItem.objects.refresh(
+        [owner_id], _recipe_ingredients(target_ids)
+    )
+
+
+def _refresh_recipe_ingredient(item, ingredient_ids):
+    user_ids = _cart_users([item.recipe_id])
+    if user_ids:
+        ShoppingListItem.objects.refresh(user_ids, ingredient_ids)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def saved_recipe_ingredient_shopping_list(
+    sender, instance, created=False, **kwargs
+):
+    # An edited row may have had another ingredient before.
+    _refresh_recipe_ingredient(
+        instance, [instance.ingredient_id] if created else None
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def deleted_recipe_ingredient_shopping_list(
+    sender, instance, origin=None, **kwargs
+):
+    # Items of a deleted ingredient are deleted with it.
+    if _deleted_directly(origin, RecipeIngredient):
+        _refresh_recipe_ingredient(instance, [instance.ingredient_id])
+
+
+@receiver(recipe_ingredients_changed)
+def bulk_recipe_ingredients_shopping_list(sender, recipe_ids, **kwargs):
+    user_ids = _cart_users(recipe_ids)
+    if user_ids:
+        ShoppingListItem.objects.refresh(
+            user_ids, _recipe_ingredients(recipe_ids)
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_shopping_lists(sender, instance, **kwargs):
+    # Its cart and ingredient rows are gone by post_delete.
+    instance.shopping_list_scope = (
+        _cart_users([instance.pk]),
+        _recipe_ingredients([instance.pk]),
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def deleted_recipe_shopping_lists(sender, instance, **kwargs):
+    user_ids, ingredient_ids = getattr(
+        instance, "shopping_list_scope", ((), ())
+    )
+    if user_ids:
+        ShoppingListItem.objects.refresh(user_ids, ingredient_ids)
@@ -0,0 +1,46 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+# Copied from recipes.images, so later changes there leave this alone
+AVATAR_VARIANTS = ("avatar-small",)
+
+
+def variant_stored(name, variant):
+    # The JPEG of a variant is written last, so it marks a finished one.
+    root, _ = os.path.splitext(name)
+    return default_storage.exists(f"{root}.{variant}.jpeg")
+
+
+def record_stored_variants(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    names = User.objects.exclude(avatar="").values_list(
+        "avatar", flat=True
+    ).distinct()
+    for name in names.iterator():
+        if all(variant_stored(name, variant) for variant in AVATAR_VARIANTS):
+            User.objects.filter(avatar=name).update(avatar_with_variants=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_with_variants",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=100,
+                verbose_name="Аватар с готовыми вариантами",
+            ),
+        ),
+        migrations.RunPython(
+            record_stored_variants, migrations.RunPython.noop
+        ),
+    ]
@@ -11,6 +11,21 @@ class User(AbstractUser):
         upload_to="avatars/",
         default="avatars/default.jpg"
     )
+    avatar_with_variants = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name="Аватар с готовыми вариантами",
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество рецептов"
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество подписчиков"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name="Дата изменения"
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username"]
@@ -36,3 +51,5 @@ class Follow(models.Model):
                 name="unique_follow"
             )
         ]
+        verbose_name = "Подписка"
+        verbose_name_plural = "Подписки"